@@ -0,0 +1,126 @@
+import asyncio
+import random
+import time
+import aiohttp
+from Weather_Metrics import metrics
+
+# Defaults sized for the OpenWeatherMap free plan (60 calls/minute)
+DEFAULT_CALLS_PER_MINUTE = 60
+DEFAULT_CONCURRENCY = 20
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BACKOFF_BASE = 1.0
+DEFAULT_BACKOFF_CAP = 30.0
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+# Token bucket limiter: refills at calls_per_minute, allows bursts up to capacity
+class TokenBucket:
+    def __init__(self, calls_per_minute, capacity=None):
+        self.rate = calls_per_minute / 60.0
+        self.capacity = capacity or max(1, int(self.rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self.lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+# Full-jitter exponential backoff, honouring Retry-After when the server sends it
+def backoff_delay(attempt, retry_after=None, base=DEFAULT_BACKOFF_BASE, cap=DEFAULT_BACKOFF_CAP):
+    if retry_after is not None:
+        try:
+            return min(cap, float(retry_after))
+        except ValueError:
+            pass
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+async def fetch_city_async(session, limiter, city, base_url, api_key,
+                           max_retries=DEFAULT_MAX_RETRIES, log=print):
+    params = {
+        "lat": city[2],
+        "lon": city[3],
+        "appid": api_key,
+        "units": "metric"
+    }
+    for attempt in range(max_retries + 1):
+        await limiter.acquire()
+        started = time.perf_counter()
+        try:
+            async with session.get(base_url, params=params) as response:
+                if response.status == 200:
+                    payload = await response.json()
+                    metrics.record("http", time.perf_counter() - started)
+                    metrics.incr("http_ok")
+                    return payload
+                metrics.record("http", time.perf_counter() - started)
+                if response.status not in RETRY_STATUSES:
+                    metrics.incr("http_failed")
+                    log(f"Failed to fetch weather for {city[1]}: HTTP {response.status}")
+                    return None
+                delay = backoff_delay(attempt, response.headers.get("Retry-After"))
+                reason = f"HTTP {response.status}"
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            delay = backoff_delay(attempt)
+            reason = str(e) or type(e).__name__
+
+        if attempt < max_retries:
+            metrics.incr("http_retries")
+            log(f"Retrying {city[1]} in {delay:.2f}s after {reason} (attempt {attempt + 1}/{max_retries})")
+            await asyncio.sleep(delay)
+
+    metrics.incr("http_failed")
+    log(f"Failed to fetch weather for {city[1]} after {max_retries} retries")
+    return None
+
+
+# Fetch one city while holding a concurrency slot; with on_result the payload is
+# handed off (possibly blocking on a full queue) before the slot is released
+async def fetch_and_emit(session, limiter, semaphore, city, base_url, api_key,
+                         max_retries, log, on_result):
+    async with semaphore:
+        payload = await fetch_city_async(session, limiter, city, base_url, api_key, max_retries, log)
+        if on_result is None:
+            return payload
+        await asyncio.get_running_loop().run_in_executor(None, on_result, city, payload)
+    return None
+
+
+async def fetch_all_async(cities, base_url, api_key, calls_per_minute, concurrency,
+                          max_retries, timeout, log, on_result=None):
+    limiter = TokenBucket(calls_per_minute)
+    semaphore = asyncio.Semaphore(concurrency)
+    # One keep-alive client shared by every request in the run
+    connector = aiohttp.TCPConnector(limit=concurrency, keepalive_timeout=60)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
+        tasks = [
+            fetch_and_emit(session, limiter, semaphore, city, base_url, api_key, max_retries, log, on_result)
+            for city in cities
+        ]
+        payloads = await asyncio.gather(*tasks)
+    return list(zip(cities, payloads))
+
+
+# Fetch weather for all cities concurrently; returns [(city, payload or None), ...]
+# When on_result(city, payload) is given, results are streamed to it instead
+def fetch_weather_data_async(cities, base_url, api_key,
+                             calls_per_minute=DEFAULT_CALLS_PER_MINUTE,
+                             concurrency=DEFAULT_CONCURRENCY,
+                             max_retries=DEFAULT_MAX_RETRIES,
+                             timeout=30, log=print, on_result=None):
+    return asyncio.run(fetch_all_async(
+        cities, base_url, api_key, calls_per_minute, concurrency, max_retries, timeout, log, on_result
+    ))
@@ -0,0 +1,432 @@
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+import statistics
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Everything runs in this schema of the configured database, so real tables are never touched
+BENCH_SCHEMA = os.getenv("BENCH_SCHEMA", "weather_bench_etl")
+# Flattened records whose values seed the stub API's payloads
+SAMPLE_WEATHER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pakistani_cities_weather.json")
+
+SCENARIOS = [100, 1000, 10000]
+WORKLOADS = ["etl", "insert-rowwise", "insert-bulk", "forecast"]
+
+
+# ---- Stub OpenWeatherMap server ----
+
+# Serves /weather?lat=&lon= and /group?id=,... with payloads in the OpenWeatherMap shape.
+# Values come from the sample records; latency, 429s and 5xx errors are drawn from a seeded RNG.
+class StubWeatherServer:
+    def __init__(self, port=0, latency_ms=20, jitter_ms=10, rate_429=0.0, error_rate=0.0, seed=42,
+                 sample_path=SAMPLE_WEATHER_PATH):
+        with open(sample_path, encoding="utf-8") as f:
+            self.samples = json.load(f)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.counts = {"requests": 0, "429": 0, "errors": 0}
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self.handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="stub-owm", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    # One draw per request: (delay seconds, outcome) where outcome is "ok", "429" or "error"
+    def draw(self):
+        with self.rng_lock:
+            delay = max(0.0, self.rng.gauss(self.latency_ms, self.jitter_ms)) / 1000
+            roll = self.rng.random()
+            age = self.rng.randint(0, 600)
+            self.counts["requests"] += 1
+            if roll < self.rate_429:
+                self.counts["429"] += 1
+                return delay, "429", age
+            if roll < self.rate_429 + self.error_rate:
+                self.counts["errors"] += 1
+                return delay, "error", age
+        return delay, "ok", age
+
+    # Stable OpenWeatherMap-style id for a coordinate
+    @staticmethod
+    def station_id(lat, lon):
+        digest = hashlib.sha1(f"{float(lat):.4f},{float(lon):.4f}".encode()).hexdigest()
+        return 1000000 + int(digest[:8], 16) % 9000000
+
+    def payload(self, station_id, lat, lon, age):
+        sample = self.samples[station_id % len(self.samples)]
+        temp = sample["temperature_c"]
+        return {
+            "coord": {"lon": lon, "lat": lat},
+            "weather": [{"id": 800, "main": sample["weather_main"], "description": sample["weather_description"], "icon": "01d"}],
+            "base": "stations",
+            "main": {"temp": temp, "feels_like": temp, "temp_min": temp - 1, "temp_max": temp + 1,
+                     "pressure": 1002, "humidity": sample["humidity_percent"]},
+            "visibility": 10000,
+            "wind": {"speed": sample["wind_speed_mps"], "deg": station_id % 360},
+            "clouds": {"all": 0},
+            "dt": int(time.time()) - age,
+            "sys": {"country": "PK"},
+            "timezone": 18000,
+            "id": station_id,
+            "name": sample["city_name"],
+            "cod": 200,
+        }
+
+    def handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                delay, outcome, age = server.draw()
+                time.sleep(delay)
+                if outcome == "429":
+                    return self.reply(429, {"cod": 429, "message": "rate limited"}, {"Retry-After": "1"})
+                if outcome == "error":
+                    return self.reply(503, {"cod": 503, "message": "unavailable"})
+
+                if url.path.endswith("/group"):
+                    ids = [int(i) for i in query.get("id", [""])[0].split(",") if i]
+                    items = [server.payload(station_id, 0.0, 0.0, age) for station_id in ids]
+                    return self.reply(200, {"cnt": len(items), "list": items})
+                try:
+                    lat, lon = float(query["lat"][0]), float(query["lon"][0])
+                except (KeyError, ValueError):
+                    return self.reply(400, {"cod": 400, "message": "Nothing to geocode"})
+                return self.reply(200, server.payload(server.station_id(lat, lon), lat, lon, age))
+
+            def reply(self, status, body, headers=None):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+# ---- Synthetic data ----
+
+# Fresh benchmark schema at the current migration level, with cities and months of history
+def prepare_bench_data(cities, months, step_hours):
+    from Weather_Migrations import get_db_connection, migrate, create_month_partitions, add_months
+    from Weather_Migrations_Benchmark import create_bench_schema, fill_synthetic_data
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            create_bench_schema(cursor, BENCH_SCHEMA)
+        conn.commit()
+        migrate(conn)
+        with conn.cursor() as cursor:
+            this_month = datetime.now().date().replace(day=1)
+            create_month_partitions(cursor, add_months(this_month, -months - 1), this_month)
+            rows, first, last = fill_synthetic_data(cursor, cities, months=months, step_hours=step_hours)
+            cursor.execute("UPDATE cities SET population = (1000000 / city_id)::BIGINT;")
+            cursor.execute("ANALYZE;")
+        conn.commit()
+    finally:
+        conn.close()
+    return rows, first, last
+
+def drop_bench_data():
+    from Weather_Migrations import get_db_connection
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE;")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# ---- Scenario runner (executed in a child process so peak RSS is per scenario) ----
+
+def peak_rss_mb():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+    except ImportError:
+        try:
+            import psutil
+            return round(psutil.Process().memory_info().peak_wset / (1024 * 1024), 1)
+        except (ImportError, AttributeError):
+            return None
+
+# Discards records so file sinks do not skew the timings
+class NullSink:
+    def write(self, record):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+PKT = timezone(timedelta(hours=5))
+run_base = datetime.now(PKT).replace(second=0, microsecond=0) + timedelta(minutes=1)
+
+# Insert benchmarks write one observation per city at a future minute per run, then delete it again
+def observed_at(run):
+    return run_base + timedelta(minutes=run)
+
+def delete_observations(run):
+    import Weather_ETL_DB as etl
+
+    observed = observed_at(run)
+    with etl.pooled_connection() as conn:
+        conn.cursor().execute("DELETE FROM weather_data WHERE date = %s AND time = %s;",
+                              (observed.date(), observed.time()))
+
+def synthetic_observations(cities, run):
+    observed = observed_at(run)
+    return [
+        (city[0], {
+            "dt": int(observed.timestamp()),
+            "main": {"temp": 30.0 + city[0] % 10, "humidity": 40},
+            "wind": {"speed": 3.2, "deg": 180},
+            "weather": [{"main": "Clear", "description": "clear sky"}],
+        })
+        for city in cities
+    ]
+
+def run_etl(cities, run, args):
+    import Weather_ETL_DB as etl
+
+    etl.load_weather_type_cache()
+    stats = etl.fetch_weather_data_parallel(cities, fetch_mode=args.fetch_mode, sink=NullSink(),
+                                            archive_raw=False, freshness_ttl=0, update_rollups=args.rollups)
+    return stats["inserted"]
+
+def run_insert_rowwise(cities, run, args):
+    import Weather_ETL_DB as etl
+
+    for city_id, payload in synthetic_observations(cities, run):
+        etl.insert_weather_data_into_db(payload, city_id, 1, "clear sky")
+    return len(cities)
+
+def run_insert_bulk(cities, run, args):
+    import Weather_ETL_DB as etl
+
+    rows = []
+    for city_id, payload in synthetic_observations(cities, run):
+        observed = datetime.fromtimestamp(payload["dt"], PKT)
+        rows.append((city_id, payload["main"]["temp"], payload["main"]["humidity"], payload["wind"]["speed"],
+                     payload["wind"]["deg"], 1, "clear sky", observed.strftime("%Y-%m-%d"), observed.strftime("%H:%M:%S")))
+    return len(etl.insert_weather_data_bulk(rows))
+
+def run_forecast(cities, run, args):
+    import Weather_Prediction as prediction
+
+    engine = prediction.get_db_engine()
+    wanted = {city[0] for city in cities}
+    histories = {
+        city_id: frame
+        for city_id, frame in prediction.split_history_by_city(prediction.fetch_all_temperature_data(engine)).items()
+        if city_id in wanted
+    }
+    targets = prediction.forecast_targets()
+    forecaster = prediction.FORECASTERS[args.forecast_engine]()
+    prediction.run_forecasts_batched(engine, [(city[0], city[1]) for city in cities], targets, histories, forecaster)
+    engine.dispose()
+    return len(histories)
+
+SCENARIO_RUNNERS = {
+    "etl": run_etl,
+    "insert-rowwise": run_insert_rowwise,
+    "insert-bulk": run_insert_bulk,
+    "forecast": run_forecast,
+}
+
+def run_scenario(args):
+    import Weather_ETL_DB as etl
+    from Weather_Metrics import metrics
+
+    etl.init_db_pool(etl.MAX_WORKERS)
+    try:
+        with etl.pooled_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT city_id, city_name, latitude, longitude FROM cities ORDER BY city_id LIMIT %s;",
+                           (args.cities,))
+            cities = cursor.fetchall()
+
+        runner = SCENARIO_RUNNERS[args.workload]
+        latencies = []
+        items = 0
+        metrics.reset()
+        for run in range(args.runs):
+            started = time.perf_counter()
+            items += runner(cities, run, args)
+            latencies.append(time.perf_counter() - started)
+            if args.workload.startswith("insert"):
+                delete_observations(run)
+    finally:
+        etl.close_db_pool()
+
+    stages = metrics.summary()["stages"]
+    result = {
+        "workload": args.workload,
+        "cities": len(cities),
+        "runs": args.runs,
+        "mean_s": round(statistics.mean(latencies), 3),
+        "p50_s": round(statistics.median(latencies), 3),
+        "max_s": round(max(latencies), 3),
+        "runs_per_sec": round(args.runs / sum(latencies), 4),
+        "items_per_sec": round(items / sum(latencies), 1),
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": {stage: {"p50_ms": s["p50_ms"], "p95_ms": s["p95_ms"], "p99_ms": s["p99_ms"]} for stage, s in stages.items()},
+        "counters": metrics.summary()["counters"],
+    }
+    with open(args.result_file, "w", encoding="utf-8") as f:
+        json.dump(result, f)
+
+
+# ---- Orchestration ----
+
+def scenario_env(stub_url, args):
+    env = dict(os.environ)
+    env.update({
+        "WEATHER_API_URL": f"{stub_url}/data/2.5/weather",
+        "WEATHER_GROUP_API_URL": f"{stub_url}/data/2.5/group",
+        "WEATHER_API_KEY": "benchmark",
+        # The stub has no quota, so only concurrency limits the async engine
+        "WEATHER_API_CALLS_PER_MINUTE": "1000000",
+        "ETL_MAX_WORKERS": str(args.workers),
+        # Every connection (psycopg2 and SQLAlchemy) resolves tables in the benchmark schema
+        "PGOPTIONS": f"-c search_path={BENCH_SCHEMA}",
+        "PYTHONPATH": os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                    os.environ.get("PYTHONPATH")])),
+    })
+    return env
+
+def run_benchmarks(args):
+    largest = max(args.scenarios)
+    if not args.reuse_data:
+        print(f"Generating {largest} cities with {args.history_months} months of history "
+              f"every {args.history_step_hours}h in schema {BENCH_SCHEMA}...")
+        started = time.perf_counter()
+        rows, first, last = prepare_bench_data(largest, args.history_months, args.history_step_hours)
+        print(f"{rows} rows from {first} to {last} in {time.perf_counter() - started:.1f}s")
+
+    stub = StubWeatherServer(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                             rate_429=args.rate_429, error_rate=args.error_rate, seed=args.seed).start()
+    env = scenario_env(stub.url, args)
+    workdir = tempfile.mkdtemp(prefix="weather_bench_")
+    results = []
+    try:
+        for workload in args.workloads:
+            for cities in args.scenarios:
+                result_file = os.path.join(workdir, f"{workload}_{cities}.json")
+                command = [
+                    sys.executable, os.path.abspath(__file__), "scenario",
+                    "--workload", workload, "--cities", str(cities), "--runs", str(args.runs),
+                    "--fetch-mode", args.fetch_mode, "--forecast-engine", args.forecast_engine,
+                    "--result-file", result_file,
+                ]
+                if not args.rollups:
+                    command.append("--no-rollups")
+                print(f"Running {workload} with {cities} cities...", flush=True)
+                completed = subprocess.run(command, env=env, cwd=workdir, stdout=subprocess.DEVNULL)
+                if completed.returncode != 0:
+                    print(f"  {workload} with {cities} cities failed (exit code {completed.returncode})")
+                    continue
+                with open(result_file, encoding="utf-8") as f:
+                    result = json.load(f)
+                print(f"  {result['mean_s']}s per run, {result['items_per_sec']} items/s, peak RSS {result['peak_rss_mb']} MB")
+                results.append(result)
+    finally:
+        stub.stop()
+        if not args.keep_data:
+            drop_bench_data()
+
+    print(f"\nStub API: {stub.counts['requests']} requests, {stub.counts['429']} rate limited, {stub.counts['errors']} errors")
+    print(f"\n{'workload':<15} {'cities':>7} {'runs':>5} {'mean s':>9} {'p50 s':>9} {'runs/s':>8} {'items/s':>10} {'peak RSS':>10}")
+    for r in results:
+        print(f"{r['workload']:<15} {r['cities']:>7} {r['runs']:>5} {r['mean_s']:>9.3f} {r['p50_s']:>9.3f} "
+              f"{r['runs_per_sec']:>8.3f} {r['items_per_sec']:>10.1f} {r['peak_rss_mb'] or 0:>7.1f} MB")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"started_at": datetime.now().isoformat(timespec="seconds"), "args": vars(args),
+                       "stub": stub.counts, "results": results}, f, indent=2, default=str)
+        print(f"\nResults written to {args.output}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks against a stub weather API and synthetic data")
+    subparsers = parser.add_subparsers(dest="command")
+
+    run_parser = subparsers.add_parser("run", help="Generate data, start the stub API and run every scenario (default)")
+    run_parser.add_argument("--scenarios", type=int, nargs="+", default=SCENARIOS, help="City counts to run")
+    run_parser.add_argument("--workloads", nargs="+", choices=WORKLOADS, default=WORKLOADS)
+    run_parser.add_argument("--runs", type=int, default=3, help="Repetitions per scenario")
+    run_parser.add_argument("--workers", type=int, default=5, help="ETL_MAX_WORKERS for the scenarios")
+    run_parser.add_argument("--fetch-mode", choices=["threads", "async", "group"], default="threads")
+    run_parser.add_argument("--forecast-engine", choices=["harmonic", "prophet"], default="harmonic")
+    run_parser.add_argument("--no-rollups", dest="rollups", action="store_false")
+    run_parser.add_argument("--latency-ms", type=float, default=20, help="Mean stub response latency")
+    run_parser.add_argument("--jitter-ms", type=float, default=10, help="Std deviation of the stub latency")
+    run_parser.add_argument("--rate-429", type=float, default=0.0, help="Fraction of requests answered with 429")
+    run_parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--history-months", type=int, default=1)
+    run_parser.add_argument("--history-step-hours", type=int, default=3)
+    run_parser.add_argument("--reuse-data", action="store_true", help="Use the data left by a previous --keep-data run")
+    run_parser.add_argument("--keep-data", action="store_true", help=f"Keep the {BENCH_SCHEMA} schema afterwards")
+    run_parser.add_argument("--output", default="benchmark_results.json", help="JSON results file")
+
+    scenario_parser = subparsers.add_parser("scenario", help=argparse.SUPPRESS)
+    scenario_parser.add_argument("--workload", choices=WORKLOADS, required=True)
+    scenario_parser.add_argument("--cities", type=int, required=True)
+    scenario_parser.add_argument("--runs", type=int, default=3)
+    scenario_parser.add_argument("--fetch-mode", default="threads")
+    scenario_parser.add_argument("--forecast-engine", default="harmonic")
+    scenario_parser.add_argument("--no-rollups", dest="rollups", action="store_false")
+    scenario_parser.add_argument("--result-file", required=True)
+
+    argv = sys.argv[1:]
+    if not argv or argv[0] not in ("run", "scenario", "-h", "--help"):
+        argv = ["run"] + argv
+    args = parser.parse_args(argv)
+    if args.command == "scenario":
+        run_scenario(args)
+    else:
+        run_benchmarks(args)
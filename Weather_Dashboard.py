@@ -2,25 +2,61 @@ import streamlit as st
 import pandas as pd
 import psycopg2
 from sqlalchemy import create_engine, text
+from sqlalchemy.exc import ProgrammingError
 import plotly.express as px
+import plotly.graph_objects as go
 from datetime import datetime, timedelta
 import os
+import math
+import time
 import urllib.parse
 from dotenv import load_dotenv
+from Weather_Spatial import get_city_index
+from Weather_Metrics import metrics, timed
 
 # Load environment variables
 load_dotenv()
 
-# Database connection function
+# How long query results stay cached, and how often we check for a new ETL run
+CACHE_TTL_SECONDS = int(os.getenv("DASHBOARD_CACHE_TTL", "600"))
+DATA_VERSION_TTL_SECONDS = int(os.getenv("DASHBOARD_DATA_VERSION_TTL", "30"))
+# Upper bound on points sent to a comparison chart, shared across all selected cities
+COMPARE_POINT_BUDGET = int(os.getenv("DASHBOARD_POINT_BUDGET", "2000"))
+
+# Metrics offered in comparison mode (label -> weather_data column)
+COMPARE_METRICS = {
+    "Temperature (°C)": "temperature_c",
+    "Humidity (%)": "humidity_percent",
+    "Wind Speed (m/s)": "wind_speed_mps",
+}
+
+# Database connection function (one engine shared by every session and rerun)
+@st.cache_resource
 def get_db_connection():
     user = os.getenv("DB_USER")
     password = urllib.parse.quote_plus(os.getenv("DB_PASSWORD"))
     host = os.getenv("DB_HOST")
     port = os.getenv("DB_PORT")
     db = os.getenv("DB_NAME")
-    return create_engine(f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{db}")
+    return create_engine(f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{db}", pool_pre_ping=True)
+
+# Changes whenever rows are inserted into weather_data (or its partitions), so cached
+# results keyed on it are dropped as soon as a new ETL run lands
+@st.cache_data(ttl=DATA_VERSION_TTL_SECONDS)
+@timed("dashboard_query.get_data_version")
+def get_data_version():
+    engine = get_db_connection()
+    query = text("""
+        SELECT COALESCE(SUM(n_tup_ins), 0)
+        FROM pg_stat_user_tables
+        WHERE relname LIKE 'weather\\_data%'
+    """)
+    with engine.connect() as conn:
+        return int(conn.execute(query).scalar())
 
 # Fetch cities from DB
+@st.cache_data(ttl=CACHE_TTL_SECONDS)
+@timed("dashboard_query.fetch_cities_from_db")
 def fetch_cities_from_db():
     engine = get_db_connection()
     
@@ -31,53 +67,309 @@ def fetch_cities_from_db():
     with engine.connect() as conn:
         result = conn.execute(query).fetchall()
     
-    return result
+    return [tuple(row) for row in result]
+
+# City coordinates for the spatial index
+@st.cache_data(ttl=CACHE_TTL_SECONDS)
+@timed("dashboard_query.fetch_city_locations")
+def fetch_city_locations():
+    engine = get_db_connection()
+    query = text("SELECT city_id, city_name, latitude, longitude FROM cities WHERE latitude IS NOT NULL AND longitude IS NOT NULL")
+    with engine.connect() as conn:
+        result = conn.execute(query).fetchall()
+    return [tuple(row) for row in result]
+
+# Latest reading of each city within the last `hours` hours; date and time are stored in PKT
+@st.cache_data(ttl=CACHE_TTL_SECONDS)
+@timed("dashboard_query.fetch_latest_readings")
+def fetch_latest_readings(hours, data_version=None):
+    engine = get_db_connection()
+    query = text("""
+    SELECT DISTINCT ON (city_id) city_id, date, time, temperature_c, humidity_percent, wind_speed_mps
+    FROM weather_data
+    WHERE date >= CAST((now() AT TIME ZONE 'Asia/Karachi') - make_interval(hours => :hours) AS date)
+      AND date + time >= (now() AT TIME ZONE 'Asia/Karachi') - make_interval(hours => :hours)
+    ORDER BY city_id, date DESC, time DESC
+    """)
+    return pd.read_sql(query, engine, params={"hours": hours})
 
 # Fetch all available dates for a city
-def fetch_all_dates_for_city(city_id):
+@st.cache_data(ttl=CACHE_TTL_SECONDS)
+@timed("dashboard_query.fetch_all_dates_for_city")
+def fetch_all_dates_for_city(city_id, data_version=None):
     engine = get_db_connection()
-    query = f"""
+    query = text("""
     SELECT DISTINCT date
     FROM weather_data
-    WHERE city_id = {city_id}
+    WHERE city_id = :city_id
     ORDER BY date DESC
-    """
-    df = pd.read_sql(query, engine)
+    """)
+    df = pd.read_sql(query, engine, params={"city_id": city_id})
     return df['date'].tolist()
 
 # Fetch weather data for a city and a specific date
-def fetch_weather_data_for_city_and_date(city_id, selected_date):
+@st.cache_data(ttl=CACHE_TTL_SECONDS)
+@timed("dashboard_query.fetch_weather_data_for_city_and_date")
+def fetch_weather_data_for_city_and_date(city_id, selected_date, data_version=None):
     engine = get_db_connection()
-    query = f"""
+    query = text("""
     SELECT date, time, temperature_c, humidity_percent, wind_speed_mps 
     FROM weather_data
-    WHERE city_id = {city_id} AND date = '{selected_date}'
+    WHERE city_id = :city_id AND date = :selected_date
     ORDER BY time
-    """
-    df = pd.read_sql(query, engine)
+    """)
+    df = pd.read_sql(query, engine, params={"city_id": city_id, "selected_date": selected_date})
     return df
 
+# Daily rollups for a city over the last `days` days (maintained by the ETL)
+@st.cache_data(ttl=CACHE_TTL_SECONDS)
+@timed("dashboard_query.fetch_daily_rollups_for_city")
+def fetch_daily_rollups_for_city(city_id, days, data_version=None):
+    engine = get_db_connection()
+    query = text("""
+    SELECT date, temp_min_c, temp_mean_c, temp_max_c,
+           humidity_mean_percent, wind_mean_mps, wind_max_mps,
+           t.weather_name AS dominant_weather, samples
+    FROM weather_daily_rollup r
+    LEFT JOIN weather_types t ON t.weather_type_id = r.dominant_weather_type_id
+    WHERE r.city_id = :city_id AND r.date >= CURRENT_DATE - make_interval(days => :days)
+    ORDER BY date
+    """)
+    return pd.read_sql(query, engine, params={"city_id": city_id, "days": days})
+
+# Hourly rollups for a city over the last `days` days
+@st.cache_data(ttl=CACHE_TTL_SECONDS)
+@timed("dashboard_query.fetch_hourly_rollups_for_city")
+def fetch_hourly_rollups_for_city(city_id, days, data_version=None):
+    engine = get_db_connection()
+    query = text("""
+    SELECT date + make_time(hour, 0, 0) AS hour_start, temp_mean_c, humidity_mean_percent, wind_mean_mps
+    FROM weather_hourly_rollup
+    WHERE city_id = :city_id AND date >= CURRENT_DATE - make_interval(days => :days)
+    ORDER BY hour_start
+    """)
+    return pd.read_sql(query, engine, params={"city_id": city_id, "days": days})
+
+# Bucket widths that line up with clock hours and days
+BUCKET_WIDTHS_SECONDS = [300, 900, 1800, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 86400]
+
+# Smallest round bucket width that keeps cities x buckets within the point budget for the date range
+def bucket_seconds_for_range(start_date, end_date, city_count, point_budget):
+    span_seconds = ((end_date - start_date).days + 1) * 86400
+    buckets_per_city = max(1, point_budget // max(1, city_count))
+    needed = math.ceil(span_seconds / buckets_per_city)
+    for width in BUCKET_WIDTHS_SECONDS:
+        if width >= needed:
+            return width
+    return math.ceil(needed / 86400) * 86400
+
+# Several cities over a date range, aggregated in SQL into fixed-width time buckets
+# so the result never exceeds the point budget no matter how much raw data there is
+@st.cache_data(ttl=CACHE_TTL_SECONDS)
+@timed("dashboard_query.fetch_downsampled_series")
+def fetch_downsampled_series(city_ids, start_date, end_date, metric, bucket_seconds, data_version=None):
+    column = COMPARE_METRICS[metric]
+    engine = get_db_connection()
+    query = text(f"""
+    SELECT w.city_id, c.city_name,
+           to_timestamp(floor(extract(epoch FROM w.date + w.time) / :bucket) * :bucket) AT TIME ZONE 'UTC' AS bucket_start,
+           AVG(w.{column}) AS mean_value,
+           MIN(w.{column}) AS min_value,
+           MAX(w.{column}) AS max_value,
+           COUNT(*) AS samples
+    FROM weather_data w
+    JOIN cities c ON c.city_id = w.city_id
+    WHERE w.city_id = ANY(:city_ids) AND w.date BETWEEN :start_date AND :end_date
+    GROUP BY w.city_id, c.city_name, bucket_start
+    ORDER BY c.city_name, w.city_id, bucket_start
+    """)
+    series = pd.read_sql(query, engine, params={
+        "bucket": bucket_seconds,
+        "city_ids": list(city_ids),
+        "start_date": start_date,
+        "end_date": end_date,
+    })
+    # Cities that share a name stay separate series, labelled with their id
+    shared = series.groupby('city_name')['city_id'].transform('nunique') > 1
+    series['city'] = series['city_name'].where(~shared, series['city_name'] + " (#" + series['city_id'].astype(str) + ")")
+    return series
+
+# Compare several cities over a date range
+def display_comparison(cities, data_version):
+    st.title("Compare Cities")
+    city_names = [city[1] for city in cities]
+    selected_cities = st.multiselect("Cities", city_names, default=city_names[:3])
+    today = datetime.now().date()
+    date_range = st.date_input("Date range", value=(today - timedelta(days=7), today))
+    metric = st.selectbox("Metric", list(COMPARE_METRICS))
+    point_budget = st.slider("Point budget", min_value=200, max_value=10000, value=COMPARE_POINT_BUDGET, step=100)
+
+    # date_input returns a single date while the user is still picking the range
+    if not selected_cities or len(date_range) != 2:
+        st.write("Select at least one city and a start and end date.")
+        return
+    start_date, end_date = date_range
+
+    city_ids = tuple(city[0] for city in cities if city[1] in selected_cities)
+    bucket_seconds = bucket_seconds_for_range(start_date, end_date, len(city_ids), point_budget)
+
+    load_started = time.perf_counter()
+    series = fetch_downsampled_series(city_ids, start_date, end_date, metric, bucket_seconds, data_version)
+    load_ms = (time.perf_counter() - load_started) * 1000
+
+    if series.empty:
+        st.write(f"No data available between {start_date} and {end_date}.")
+        return
+
+    render_started = time.perf_counter()
+    fig = px.line(series, x='bucket_start', y='mean_value', color='city',
+                  labels={'bucket_start': 'Time', 'mean_value': metric, 'city': 'City'},
+                  title=f"{metric}, {start_date} to {end_date}")
+    st.plotly_chart(fig)
+    render_ms = (time.perf_counter() - render_started) * 1000
+
+    st.caption(
+        f"{len(series)} points ({series['samples'].sum()} readings) in {bucket_seconds / 3600:.2f}h buckets · "
+        f"load {load_ms:.0f} ms · render {render_ms:.0f} ms"
+    )
+
+    # Per-city summary over the whole range, weighting bucket means by their sample counts
+    series['weighted'] = series['mean_value'] * series['samples']
+    summary = series.groupby('city').agg(
+        min_value=('min_value', 'min'),
+        max_value=('max_value', 'max'),
+        weighted=('weighted', 'sum'),
+        samples=('samples', 'sum'),
+    )
+    summary['mean_value'] = summary['weighted'] / summary['samples']
+    st.dataframe(summary[['min_value', 'mean_value', 'max_value', 'samples']])
+
+# Interpolated heat map of the latest readings, plus nearest-city lookup
+def display_heat_map(data_version):
+    st.title("Weather Map")
+    locations = fetch_city_locations()
+    index = get_city_index(locations)
+    if index is None:
+        st.write("No city coordinates available.")
+        return
+
+    metric = st.selectbox("Metric", list(COMPARE_METRICS))
+    hours = st.slider("Readings from the last N hours", min_value=1, max_value=48, value=3)
+    column = COMPARE_METRICS[metric]
+
+    readings = fetch_latest_readings(hours, data_version)
+    if readings.empty:
+        st.write(f"No readings in the last {hours} hours.")
+        return
+
+    values = dict(zip(readings['city_id'], readings[column]))
+    grid_lats, grid_lons, grid = index.interpolate_grid(values)
+
+    fig = go.Figure()
+    fig.add_trace(go.Heatmap(x=grid_lons, y=grid_lats, z=grid, colorscale="RdYlBu_r", colorbar={"title": metric}))
+    located = readings[readings['city_id'].isin(index.positions)]
+    positions = [index.positions[city_id] for city_id in located['city_id']]
+    fig.add_trace(go.Scatter(
+        x=index.coords[positions, 1], y=index.coords[positions, 0], mode="markers",
+        marker={"size": 4, "color": "black"},
+        text=[f"{index.city_names[i]}: {value}" for i, value in zip(positions, located[column])],
+        hoverinfo="text", showlegend=False,
+    ))
+    fig.update_layout(title=f"{metric} ({len(located)} cities)", xaxis_title="Longitude", yaxis_title="Latitude",
+                      yaxis={"scaleanchor": "x"})
+    st.plotly_chart(fig)
+
+    st.subheader("Nearest cities")
+    selected_city = st.selectbox("City", index.city_names)
+    position = index.city_names.index(selected_city)
+    lat, lon = index.coords[position]
+    nearest = index.nearest(lat, lon, k=6)[1:]
+    st.dataframe(pd.DataFrame(nearest, columns=['city_id', 'city_name', 'distance_km']))
+
+# Multi-day trend views, read from the rollup tables instead of raw weather_data
+def display_trends(city_id, selected_city, data_version):
+    st.header(f"Multi-day Trends for {selected_city}")
+    days = st.slider("Days of history", min_value=3, max_value=90, value=14)
+
+    try:
+        daily = fetch_daily_rollups_for_city(city_id, days, data_version)
+        hourly = fetch_hourly_rollups_for_city(city_id, days, data_version)
+    except (ProgrammingError, pd.errors.DatabaseError) as e:
+        # The rollup tables only exist once migration 4 (or an ETL run) has created them;
+        # newer pandas wraps SQLAlchemy's error, so look down the cause chain
+        cause = e
+        while cause is not None and not isinstance(cause, psycopg2.errors.UndefinedTable):
+            cause = cause.__cause__
+        if cause is None:
+            raise
+        st.write("No rollup data yet: run `python Weather_Migrations.py migrate` to create and backfill the rollup tables.")
+        return
+    if daily.empty:
+        st.write(f"No rollup data available for {selected_city} in the last {days} days.")
+        return
+
+    # Plot Daily Temperature Range
+    st.subheader("Daily Temperature (min / mean / max)")
+    fig = px.line(daily, x='date', y=['temp_min_c', 'temp_mean_c', 'temp_max_c'], title="Daily Temperature")
+    st.plotly_chart(fig)
+
+    # Plot Daily Humidity and Wind
+    st.subheader("Daily Mean Humidity and Wind Speed")
+    fig2 = px.line(daily, x='date', y=['humidity_mean_percent', 'wind_mean_mps'], title="Daily Humidity and Wind")
+    st.plotly_chart(fig2)
+
+    # Plot Hourly Mean Temperature
+    st.subheader("Hourly Mean Temperature")
+    fig3 = px.line(hourly, x='hour_start', y='temp_mean_c', title="Hourly Mean Temperature")
+    st.plotly_chart(fig3)
+
+    st.dataframe(daily)
+
+# Query timings of this server process (cache misses only, since hits never reach the database)
+def display_query_metrics():
+    stages = {
+        stage.split(".", 1)[1]: values
+        for stage, values in metrics.summary()["stages"].items()
+        if stage.startswith("dashboard_query.")
+    }
+    with st.sidebar.expander("Query timings"):
+        if stages:
+            st.dataframe(pd.DataFrame.from_dict(stages, orient="index")[["count", "p50_ms", "p95_ms", "p99_ms", "max_ms"]])
+        else:
+            st.write("No queries run yet.")
+
 # Display the dashboard
 def display_dashboard():
-    st.title("Weather Dashboard")
-    
     # Fetch cities from the database
     cities = fetch_cities_from_db()
+
+    # Cached results are keyed on this, so a new ETL run invalidates them
+    data_version = get_data_version()
+
+    view = st.sidebar.radio("View", ["Single city", "Compare cities", "Map"])
+    if view == "Compare cities":
+        display_comparison(cities, data_version)
+        return
+    if view == "Map":
+        display_heat_map(data_version)
+        return
+
+    st.title("Weather Dashboard")
     
     # Dropdown to select city
     selected_city = st.selectbox("Select a city", [city[1] for city in cities])
     
     # Get the selected city's ID
     city_id = next(city[0] for city in cities if city[1] == selected_city)
-    
+
     # Fetch all available dates for the selected city
-    available_dates = fetch_all_dates_for_city(city_id)
+    available_dates = fetch_all_dates_for_city(city_id, data_version)
     
     # Dropdown to select the date
     selected_date = st.selectbox("Select a date", available_dates)
     
     # Fetch weather data for the selected city and date
-    weather_data = fetch_weather_data_for_city_and_date(city_id, selected_date)
+    weather_data = fetch_weather_data_for_city_and_date(city_id, selected_date, data_version)
     
     if weather_data.empty:
         st.write(f"No data available for {selected_city} on {selected_date}.")
@@ -104,5 +396,8 @@ def display_dashboard():
         fig3 = px.line(hourly_wind_speed_data, x='time', y='wind_speed_mps', title="Hourly Wind Speed")
         st.plotly_chart(fig3)
 
+    display_trends(city_id, selected_city, data_version)
+
 if __name__ == "__main__":
     display_dashboard()
+    display_query_metrics()
@@ -1,16 +1,34 @@
 import os
+import argparse
 import requests
 import json
+import csv
+import queue
+import textwrap
+import sqlite3
 import pandas as pd
 import psycopg2
-from datetime import datetime, timezone, timedelta
+from psycopg2 import pool
+from psycopg2.extras import execute_values
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, datetime, timezone, timedelta
 from dotenv import load_dotenv
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
+import time
+import random
+import shlex
+import signal
+import subprocess
+import sys
+from Weather_Metrics import BufferedLogWriter, metrics, profiled, set_profiling, dump_profiles, format_summary
 
 # Load the API key from .env
 load_dotenv()
 API_KEY = os.getenv("WEATHER_API_KEY")
+WEATHER_API_URL = os.getenv("WEATHER_API_URL", "https://api.openweathermap.org/data/2.5/weather")
+WEATHER_GROUP_API_URL = os.getenv("WEATHER_GROUP_API_URL", "https://api.openweathermap.org/data/2.5/group")
 
 DB_HOST = os.getenv("DB_HOST")
 DB_NAME = os.getenv("DB_NAME")
@@ -18,6 +36,70 @@ DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_PORT = os.getenv("DB_PORT")
 
+MAX_WORKERS = int(os.getenv("ETL_MAX_WORKERS", "5"))
+# Seconds before a weather API request is abandoned, so a hung socket cannot stall a run
+HTTP_TIMEOUT_SECONDS = float(os.getenv("ETL_HTTP_TIMEOUT", "30"))
+BULK_BATCH_SIZE = int(os.getenv("ETL_BULK_BATCH_SIZE", "500"))
+
+# "threads" (requests + thread pool), "async" (aiohttp + token bucket)
+# or "group" (bulk group endpoint, 20 cities per call)
+FETCH_MODE = os.getenv("ETL_FETCH_MODE", "threads")
+API_CALLS_PER_MINUTE = int(os.getenv("WEATHER_API_CALLS_PER_MINUTE", "60"))
+ASYNC_CONCURRENCY = int(os.getenv("ETL_ASYNC_CONCURRENCY", "20"))
+
+# The group endpoint accepts at most 20 OpenWeatherMap city IDs per call
+GROUP_SIZE = 20
+OWM_ID_MAP_PATH = os.getenv("ETL_OWM_ID_MAP", "owm_city_ids.json")
+
+# Streaming pipeline queue bound and how long the loader waits before flushing a partial batch
+QUEUE_SIZE = int(os.getenv("ETL_QUEUE_SIZE", "100"))
+LOAD_FLUSH_SECONDS = float(os.getenv("ETL_LOAD_FLUSH_SECONDS", "2"))
+# Max payloads the parse stage normalizes in one vectorized pass
+PARSE_BATCH_SIZE = int(os.getenv("ETL_PARSE_BATCH_SIZE", "100"))
+
+# "append" writes JSON Lines and appends to the CSV, "parquet" writes date_pkt
+# partitions, "snapshot" rewrites the indented JSON and CSV like the old exports
+SINK_MODE = os.getenv("ETL_SINK_MODE", "append")
+JSON_EXPORT_PATH = "pakistani_cities_weather.json"
+JSONL_PATH = "pakistani_cities_weather.jsonl"
+CSV_PATH = "cleaned_weather_data.csv"
+PARQUET_DIR = os.getenv("ETL_PARQUET_DIR", "weather_parquet")
+PARQUET_FLUSH_ROWS = int(os.getenv("ETL_PARQUET_FLUSH_ROWS", "500"))
+
+# Skip cities whose last observation is younger than this many seconds (0 disables)
+FRESHNESS_TTL_SECONDS = int(os.getenv("ETL_FRESHNESS_TTL", "600"))
+FRESHNESS_DB_PATH = os.getenv("ETL_FRESHNESS_DB", "weather_freshness.sqlite")
+
+# Maintain weather_hourly_rollup / weather_daily_rollup after each run
+UPDATE_ROLLUPS = os.getenv("ETL_UPDATE_ROLLUPS", "1") == "1"
+
+# Only poll one representative city per cluster of cities within this radius (0 = poll every city)
+THIN_RADIUS_KM = float(os.getenv("ETL_THIN_RADIUS_KM", "0"))
+
+# Raw API payload archive (Parquet, partitioned by PKT date and hour)
+ARCHIVE_RAW = os.getenv("ETL_ARCHIVE_RAW", "1") == "1"
+ARCHIVE_DIR = os.getenv("ETL_ARCHIVE_DIR", "weather_archive")
+ARCHIVE_FLUSH_ROWS = int(os.getenv("ETL_ARCHIVE_FLUSH_ROWS", "1000"))
+
+# Resident scheduler (--daemon): population tiers as min_population:interval_seconds, largest first
+SCHEDULER_TIERS = os.getenv("SCHEDULER_TIERS", "100000:600,0:3600")
+SCHEDULER_TICK_SECONDS = int(os.getenv("SCHEDULER_TICK_SECONDS", "60"))
+# Each city's next poll is pushed back by up to this fraction of its interval, spreading load
+SCHEDULER_JITTER = float(os.getenv("SCHEDULER_JITTER", "0.1"))
+# API calls allowed per minute across all tiers
+SCHEDULER_API_BUDGET = int(os.getenv("SCHEDULER_API_BUDGET_PER_MINUTE", str(API_CALLS_PER_MINUTE)))
+SCHEDULER_CITY_REFRESH_SECONDS = int(os.getenv("SCHEDULER_CITY_REFRESH_SECONDS", "3600"))
+# Longest wait between cycles while they keep failing (the wait doubles from one tick)
+SCHEDULER_MAX_BACKOFF_SECONDS = int(os.getenv("SCHEDULER_MAX_BACKOFF_SECONDS", "900"))
+# Run Weather_Prediction.py once this many new rows have arrived, at most every FORECAST_MIN_INTERVAL
+FORECAST_TRIGGER_ROWS = int(os.getenv("SCHEDULER_FORECAST_TRIGGER_ROWS", "500"))
+FORECAST_MIN_INTERVAL_SECONDS = int(os.getenv("SCHEDULER_FORECAST_MIN_INTERVAL", "3600"))
+FORECAST_ARGS = os.getenv("SCHEDULER_FORECAST_ARGS", "")
+# Postgres advisory lock key held while an ETL run is in progress
+ETL_RUN_LOCK_KEY = 72401
+# Unique keys the ON CONFLICT upserts rely on (created by migration 1 in Weather_Migrations.py)
+UPSERT_KEYS = [("weather_data", ["city_id", "date", "time"]), ("weather_types", ["weather_name"])]
+
 
 # Connect to PostgreSQL
 def get_db_connection():
@@ -30,15 +112,108 @@ def get_db_connection():
         )
     return conn
 
+# Shared connection pool for the whole ETL run
+db_pool = None
+db_pool_slots = None
+pool_stats_lock = threading.Lock()
+pool_stats = {"checkouts": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+
+def init_db_pool(max_workers=MAX_WORKERS):
+    global db_pool, db_pool_slots
+    if db_pool is None:
+        # One connection per worker thread plus one for the main thread
+        max_conn = max_workers + 1
+        db_pool = pool.ThreadedConnectionPool(
+            1, max_conn,
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            host=DB_HOST,
+            port=DB_PORT
+        )
+        # ThreadedConnectionPool raises when exhausted, so callers queue on this instead
+        db_pool_slots = threading.BoundedSemaphore(max_conn)
+    return db_pool
+
+def close_db_pool():
+    global db_pool, db_pool_slots
+    if db_pool is not None:
+        db_pool.closeall()
+        db_pool = None
+        db_pool_slots = None
+
+def reset_pool_stats():
+    with pool_stats_lock:
+        pool_stats.update({"checkouts": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0})
+
+@contextmanager
+def pooled_connection():
+    if db_pool is None:
+        init_db_pool()
+    wait_start = time.perf_counter()
+    db_pool_slots.acquire()
+    try:
+        conn = db_pool.getconn()
+    except Exception:
+        db_pool_slots.release()
+        raise
+    waited = time.perf_counter() - wait_start
+    metrics.record("db_wait", waited)
+    with pool_stats_lock:
+        pool_stats["checkouts"] += 1
+        pool_stats["wait_seconds"] += waited
+        pool_stats["max_wait_seconds"] = max(pool_stats["max_wait_seconds"], waited)
+
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db_pool.putconn(conn)
+        db_pool_slots.release()
+
+def log_pool_stats():
+    with pool_stats_lock:
+        checkouts = pool_stats["checkouts"]
+        total_wait = pool_stats["wait_seconds"]
+        max_wait = pool_stats["max_wait_seconds"]
+    avg_wait_ms = (total_wait / checkouts * 1000) if checkouts else 0.0
+    log_to_file(
+        f"DB pool: {checkouts} checkouts, total wait {total_wait:.3f}s, "
+        f"avg wait {avg_wait_ms:.2f}ms, max wait {max_wait * 1000:.2f}ms"
+    )
+
 # Fetch cities from DB
 def fetch_cities_from_db():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT city_id, city_name, latitude, longitude FROM cities;")
-    cities = cursor.fetchall()
-    conn.close()
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT city_id, city_name, latitude, longitude FROM cities;")
+        cities = cursor.fetchall()
     return cities
 
+# Population per city_id (None where GeoNames had none); empty when the column has not been migrated yet
+def fetch_city_populations():
+    try:
+        with pooled_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT city_id, population FROM cities;")
+            return dict(cursor.fetchall())
+    except psycopg2.errors.UndefinedColumn:
+        log_to_file("cities.population is missing (run Weather_Migrations.py migrate); population is treated as unknown")
+        return {}
+
+# One keep-alive HTTP session per worker thread
+http_local = threading.local()
+
+def get_http_session():
+    session = getattr(http_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        http_local.session = session
+    return session
+
 # Fetch weather data for cities
 def fetch_weather_data(city):
     params = {
@@ -47,19 +222,58 @@ def fetch_weather_data(city):
         "appid": API_KEY,
         "units": "metric"
     }
-    response = requests.get("https://api.openweathermap.org/data/2.5/weather", params=params)
+    try:
+        with metrics.timer("http"):
+            response = get_http_session().get(WEATHER_API_URL, params=params, timeout=HTTP_TIMEOUT_SECONDS)
+    except requests.RequestException:
+        # Still an API call spent, as far as the scheduler's budget is concerned
+        metrics.incr("http_failed")
+        raise
     
     if response.status_code == 200:
+        metrics.incr("http_ok")
         city_weather = response.json()
         return city_weather
     else:
+        metrics.incr("http_failed")
         print(f"Failed to fetch weather for {city[1]}")
         return None
 
+# Fetch weather for up to GROUP_SIZE OpenWeatherMap city IDs in one call
+def fetch_weather_group(owm_ids):
+    params = {
+        "id": ",".join(str(owm_id) for owm_id in owm_ids),
+        "appid": API_KEY,
+        "units": "metric"
+    }
+    try:
+        with metrics.timer("http_group"):
+            response = get_http_session().get(WEATHER_GROUP_API_URL, params=params, timeout=HTTP_TIMEOUT_SECONDS)
+    except requests.RequestException:
+        metrics.incr("http_failed")
+        raise
+
+    if response.status_code == 200:
+        metrics.incr("http_ok")
+        return response.json().get("list", [])
+    else:
+        metrics.incr("http_failed")
+        log_to_file(f"Failed to fetch weather group of {len(owm_ids)} IDs: HTTP {response.status_code}")
+        return None
+
+# Mapping of our city_id to the OpenWeatherMap city ID learned from per-city responses
+def load_owm_id_map():
+    if not os.path.exists(OWM_ID_MAP_PATH):
+        return {}
+    with open(OWM_ID_MAP_PATH, "r", encoding="utf-8") as f:
+        return {int(city_id): owm_id for city_id, owm_id in json.load(f).items()}
+
+def save_owm_id_map(id_map):
+    with open(OWM_ID_MAP_PATH, "w", encoding="utf-8") as f:
+        json.dump({str(city_id): owm_id for city_id, owm_id in id_map.items()}, f)
+
 # Insert weather data into the DB
 def insert_weather_data_into_db(weather_data, city_id, weather_type_id, weather_description):
-    conn = get_db_connection()
-    cursor = conn.cursor()
     query = """
         INSERT INTO weather_data (city_id, temperature_c, humidity_percent, wind_speed_mps, wind_direction_deg, weather_type_id, weather_description, date, time)
         VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s);
@@ -68,84 +282,223 @@ def insert_weather_data_into_db(weather_data, city_id, weather_type_id, weather_
     dt_pkt = datetime.fromtimestamp(timestamp, timezone.utc).astimezone(timezone(timedelta(hours=5)))  # Pakistan Standard Time (PKT)
     date = dt_pkt.strftime("%Y-%m-%d")
     time = dt_pkt.strftime("%H:%M:%S")
-    
-    cursor.execute(query, (
-        city_id,
-        weather_data.get("main", {}).get("temp"),
-        weather_data.get("main", {}).get("humidity"),
-        weather_data.get("wind", {}).get("speed"),
-        weather_data.get("wind", {}).get("deg"),
-        weather_type_id,
-        weather_description,
-        date,
-        time
-    ))
-    conn.commit()
-    conn.close()
-
-# Insert weather type into DB (if it doesn't exist)
-def insert_weather_type(weather_main):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT weather_type_id FROM weather_types WHERE weather_name = %s;", (weather_main,))
-    existing_type = cursor.fetchone()
-    
-    if existing_type:
-        weather_type_id = existing_type[0]
-    else:
+
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, (
+            city_id,
+            weather_data.get("main", {}).get("temp"),
+            weather_data.get("main", {}).get("humidity"),
+            weather_data.get("wind", {}).get("speed"),
+            weather_data.get("wind", {}).get("deg"),
+            weather_type_id,
+            weather_description,
+            date,
+            time
+        ))
+
+# Bulk insert weather observations in a single transaction
+# Rows are (city_id, temperature_c, humidity_percent, wind_speed_mps, wind_direction_deg,
+# weather_type_id, weather_description, date, time) and rely on the unique
+# (city_id, date, time) constraint on weather_data to drop duplicates
+def insert_weather_data_bulk(rows, batch_size=BULK_BATCH_SIZE):
+    if not rows:
+        return set()
+
+    query = """
+        INSERT INTO weather_data (city_id, temperature_c, humidity_percent, wind_speed_mps, wind_direction_deg, weather_type_id, weather_description, date, time)
+        VALUES %s
+        ON CONFLICT (city_id, date, time) DO NOTHING
+        RETURNING city_id, date, time;
+    """
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        # page_size splits large city lists into several statements inside the same transaction
+        inserted = execute_values(cursor, query, rows, page_size=batch_size, fetch=True)
+
+    return {(city_id, str(date), str(time)) for city_id, date, time in inserted}
+
+# In-memory weather_types cache, loaded once per run
+weather_type_cache = {}
+weather_type_lock = threading.Lock()
+weather_type_stats = {"hits": 0, "misses": 0}
+
+def load_weather_type_cache():
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT weather_name, weather_type_id FROM weather_types;")
+        rows = cursor.fetchall()
+    with weather_type_lock:
+        weather_type_cache.clear()
+        weather_type_cache.update(dict(rows))
+        weather_type_stats.update({"hits": 0, "misses": 0})
+    return len(rows)
+
+# Atomic upsert for a type the cache hasn't seen yet
+# Relies on the unique constraint on weather_types.weather_name
+def upsert_weather_type(weather_main):
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
         cursor.execute("""
-            INSERT INTO weather_types (weather_name) 
-            VALUES (%s) 
+            INSERT INTO weather_types (weather_name)
+            VALUES (%s)
+            ON CONFLICT (weather_name) DO UPDATE SET weather_name = EXCLUDED.weather_name
             RETURNING weather_type_id;
         """, (weather_main,))
         weather_type_id = cursor.fetchone()[0]
-    
-    conn.commit()
-    conn.close()
     return weather_type_id
 
-# Save data to CSV and JSON
-def save_weather_data_to_files(structured_data):
-    # Save to JSON
-    with open("pakistani_cities_weather.json", "w") as f:
-        json.dump(structured_data, f, indent=2)
-    print("Weather data saved to pakistani_cities_weather.json")
+# Resolve a weather type id, inserting the type if it doesn't exist
+def insert_weather_type(weather_main):
+    with weather_type_lock:
+        weather_type_id = weather_type_cache.get(weather_main)
+        if weather_type_id is not None:
+            weather_type_stats["hits"] += 1
+            return weather_type_id
+        weather_type_stats["misses"] += 1
+
+    # The upsert runs outside the lock; threads racing on the same new type all get the same id
+    weather_type_id = upsert_weather_type(weather_main)
+    with weather_type_lock:
+        return weather_type_cache.setdefault(weather_main, weather_type_id)
 
-    # Save to CSV
-    df = pd.DataFrame(structured_data)
-    df.to_csv("cleaned_weather_data.csv", index=False)
-    print("Cleaned weather data saved to cleaned_weather_data.csv")
+def log_weather_type_stats():
+    with weather_type_lock:
+        hits = weather_type_stats["hits"]
+        misses = weather_type_stats["misses"]
+        size = len(weather_type_cache)
+    log_to_file(f"Weather type cache: {hits} hits, {misses} misses, {size} types cached")
 
 def weather_entry_exists(city_id, date, time):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT 1 FROM weather_data WHERE city_id = %s AND date = %s AND time = %s;",
-        (city_id, date, time)
-    )
-    exists = cursor.fetchone() is not None
-    conn.close()
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT 1 FROM weather_data WHERE city_id = %s AND date = %s AND time = %s;",
+            (city_id, date, time)
+        )
+        exists = cursor.fetchone() is not None
     return exists
 
-# Main function to handle everything
-def main():
-    cities = fetch_cities_from_db()
-    structured_data = fetch_weather_data_parallel(cities)
-    print("Weather data fetched and stored in the database.")
-    save_weather_data_to_files(structured_data)
-    
+# Keep one city per radius_km cluster, preferring the most populous one (cities with
+# unknown population come last); cities without coordinates are kept as-is
+def thin_cities(cities, radius_km):
+    from Weather_Spatial import get_city_index
+
+    located = [city for city in cities if city[2] is not None and city[3] is not None]
+    index = get_city_index(located)
+    if index is None:
+        return cities
+    populations = fetch_city_populations()
+    priority = [populations.get(city_id) or 0 for city_id in index.city_ids.tolist()]
+    kept_ids, _ = index.representative_cities(radius_km, priority=priority)
+    kept_ids = set(kept_ids)
+    thinned = [city for city in cities if city[0] in kept_ids or city[2] is None or city[3] is None]
+    log_to_file(f"Thinned {len(cities)} cities to {len(thinned)} representatives within {radius_km:g} km")
+    return thinned
+
+# Appends the run's per-stage p50/p95/p99 summary to the metrics file and dumps profiles if enabled
+def log_run_metrics(run, **extra):
+    summary = metrics.write_summary(run, **extra)
+    log_to_file(format_summary(summary))
+    for path in dump_profiles():
+        log_to_file(f"Profile written to {path}")
+    return summary
+
+# Session-level advisory lock on its own connection, so a one-shot run and the scheduler
+# (or two schedulers) never load at the same time; yields False when another run holds it
+@contextmanager
+def etl_run_lock():
+    conn = get_db_connection()
+    try:
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_try_advisory_lock(%s);", (ETL_RUN_LOCK_KEY,))
+        acquired = cursor.fetchone()[0]
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                cursor.execute("SELECT pg_advisory_unlock(%s);", (ETL_RUN_LOCK_KEY,))
+    finally:
+        conn.close()
+
+# False (with a message) when a unique key the upserts need is missing, so the run stops up
+# front instead of failing every load batch
+def check_upsert_keys():
+    from Weather_Migrations import has_unique_index
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        missing = [f"{table} ({', '.join(columns)})" for table, columns in UPSERT_KEYS
+                   if not has_unique_index(cursor, table, columns)]
+    if missing:
+        message = f"Missing unique index on {'; '.join(missing)}: run `python Weather_Migrations.py migrate` first."
+        print(message)
+        log_to_file(message)
+        return False
+    return True
+
+# Create the coming months' weather_data partitions before loading, so rows never pile up in
+# the default partition; a failure is logged and the load goes ahead (the next call moves them)
+def ensure_weather_partitions():
+    from Weather_Migrations import ensure_future_partitions
+    try:
+        with pooled_connection() as conn:
+            created = ensure_future_partitions(conn)
+        if created:
+            log_to_file(f"Created weather_data partitions: {', '.join(created)}")
+    except psycopg2.Error as e:
+        log_to_file(f"Could not create weather_data partitions: {e}")
+
+# Main function to handle everything; returns False when the run could not load its data
+def main(fetch_mode=FETCH_MODE, sink_mode=SINK_MODE, export_json=False, archive_raw=ARCHIVE_RAW,
+         freshness_ttl=FRESHNESS_TTL_SECONDS, update_rollups=UPDATE_ROLLUPS, thin_radius_km=THIN_RADIUS_KM,
+         profile=False):
+    with etl_run_lock() as acquired:
+        if not acquired:
+            print("Another ETL run is in progress; skipping this one.")
+            log_to_file("Skipped run: another ETL run holds the run lock")
+            return True
+        return run_once(fetch_mode, sink_mode, export_json, archive_raw, freshness_ttl, update_rollups,
+                        thin_radius_km, profile)
+
+def run_once(fetch_mode, sink_mode, export_json, archive_raw, freshness_ttl, update_rollups,
+             thin_radius_km, profile):
+    if profile:
+        set_profiling(True)
+    metrics.reset()
+    init_db_pool(MAX_WORKERS)
+    reset_pool_stats()
+    try:
+        if not check_upsert_keys():
+            return False
+        ensure_weather_partitions()
+        cities = fetch_cities_from_db()
+        if thin_radius_km > 0:
+            cities = thin_cities(cities, thin_radius_km)
+        load_weather_type_cache()
+        stats = fetch_weather_data_parallel(cities, fetch_mode=fetch_mode,
+                                            sink=build_file_sink(sink_mode, export_json),
+                                            archive_raw=archive_raw,
+                                            freshness_ttl=freshness_ttl,
+                                            update_rollups=update_rollups)
+        if stats["load_errors"] and not stats["loaded_city_ids"]:
+            print(f"Every load batch failed ({stats['load_errors']} rows); see {log_file_path}.")
+            return False
+        print("Weather data fetched and stored in the database.")
+        return True
+    finally:
+        log_weather_type_stats()
+        log_pool_stats()
+        close_db_pool()
+        log_run_metrics("etl", fetch_mode=fetch_mode)
 
 
-log_lock = threading.Lock()
 log_file_path = "weather_etl_log.txt"
+# Queues messages for a background writer instead of reopening the file under a lock per message
+log_writer = BufferedLogWriter(log_file_path)
 
 def log_to_file(message):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    line = f"[{timestamp}] {message}\n"
-    with log_lock:
-        with open(log_file_path, "a", encoding="utf-8") as log_file:
-            log_file.write(line)
+    log_writer.write(message)
 
 def fetch_weather_data_sequential(cities):
     structured_data = []
@@ -186,55 +539,1222 @@ def fetch_weather_data_sequential(cities):
 
     return structured_data
 
-def fetch_weather_data_parallel(cities):
-    structured_data = []
+# ---- Normalization ----
+# Converts a batch of (city, payload) pairs into one typed DataFrame. Both the DB
+# loader (DB_COLUMNS) and the file sinks (RECORD_COLUMNS) read from this frame.
 
-    log_to_file("==== New ETL Run Started ====\n")
-    
+PKT_OFFSET_SECONDS = 5 * 3600  # Pakistan Standard Time (PKT), UTC+5
+
+DB_COLUMNS = [
+    "city_id", "temperature_c", "humidity_percent", "wind_speed_mps", "wind_direction_deg",
+    "weather_type_id", "weather_description", "date_pkt", "time_pkt"
+]
+RECORD_COLUMNS = [
+    "city_name", "temperature_c", "humidity_percent", "wind_speed_mps",
+    "weather_main", "weather_description", "date_pkt", "time_pkt"
+]
+KEY_COLUMNS = ["city_id", "date_pkt", "time_pkt"]
+
+def normalize_weather_payloads(items):
+    cities = [city for city, _ in items]
+    payloads = [weather_data for _, weather_data in items]
+    mains = [weather_data.get("main") or {} for weather_data in payloads]
+    winds = [weather_data.get("wind") or {} for weather_data in payloads]
+    weathers = [(weather_data.get("weather") or [{}])[0] for weather_data in payloads]
+
+    frame = pd.DataFrame({
+        "city_id": [city[0] for city in cities],
+        "city_name": [city[1] for city in cities],
+        "dt": pd.to_numeric(pd.Series([weather_data.get("dt") for weather_data in payloads], dtype="object"), errors="coerce"),
+        "temperature_c": pd.to_numeric(pd.Series([main.get("temp") for main in mains], dtype="object"), errors="coerce"),
+        "humidity_percent": pd.to_numeric(pd.Series([main.get("humidity") for main in mains], dtype="object"), errors="coerce"),
+        "wind_speed_mps": pd.to_numeric(pd.Series([wind.get("speed") for wind in winds], dtype="object"), errors="coerce"),
+        "wind_direction_deg": pd.to_numeric(pd.Series([wind.get("deg") for wind in winds], dtype="object"), errors="coerce"),
+        "weather_main": [weather.get("main") for weather in weathers],
+        "weather_description": [weather.get("description") for weather in weathers],
+    })
+
+    # An observation without a timestamp can't be keyed, so it can't be loaded
+    missing_dt = frame["dt"].isna()
+    if missing_dt.any():
+        log_to_file(f"Dropping {int(missing_dt.sum())} payloads without a timestamp: {', '.join(frame.loc[missing_dt, 'city_name'])}")
+        frame = frame[~missing_dt]
+
+    # Without a weather condition or a temperature it is an error body or a truncated payload,
+    # not an observation; loading it would add a made-up weather type and NULL measurements
+    incomplete = frame["weather_main"].isna() | frame["temperature_c"].isna()
+    if incomplete.any():
+        log_to_file(f"Dropping {int(incomplete.sum())} payloads without weather or temperature: {', '.join(frame.loc[incomplete, 'city_name'])}")
+        frame = frame[~incomplete]
+
+    # Integer columns are rounded to the nearest integer first; a fractional value such as
+    # 40.7 humidity would otherwise fail the nullable Int64 cast for the whole batch
+    frame[["humidity_percent", "wind_direction_deg"]] = frame[["humidity_percent", "wind_direction_deg"]].round()
+    frame = frame.astype({
+        "city_id": "int64",
+        "dt": "int64",
+        "temperature_c": "float64",
+        "humidity_percent": "Int64",
+        "wind_speed_mps": "float64",
+        "wind_direction_deg": "Int64",
+    })
+    frame["weather_description"] = frame["weather_description"].fillna("Unknown")
+
+    # One vectorized UTC -> PKT conversion for the whole batch
+    dt_pkt = pd.to_datetime(frame["dt"] + PKT_OFFSET_SECONDS, unit="s")
+    frame["date_pkt"] = dt_pkt.dt.strftime("%Y-%m-%d")
+    frame["time_pkt"] = dt_pkt.dt.strftime("%H:%M:%S")
+
+    # Only the handful of distinct weather types hit the cache
+    type_ids = {weather_main: insert_weather_type(weather_main) for weather_main in frame["weather_main"].unique()}
+    frame["weather_type_id"] = frame["weather_main"].map(type_ids).astype("int64")
+
+    return frame.reset_index(drop=True)
+
+# Plain Python values with None for missing ones, ready for psycopg2 or json
+def frame_to_python(frame, columns):
+    values = frame[columns].astype(object)
+    return values.where(frame[columns].notna(), None)
+
+def frame_to_db_rows(frame):
+    return list(frame_to_python(frame, DB_COLUMNS).itertuples(index=False, name=None))
+
+def frame_to_records(frame):
+    return frame_to_python(frame, RECORD_COLUMNS).to_dict("records")
+
+# ---- Fetch stage ----
+# Each fetcher calls emit(city, payload) for every response. emit blocks when the
+# downstream queue is full, which is what throttles fetching behind a slow database.
+
+# Set by the scheduler so fetch threads, and their keep-alive HTTP sessions, survive between cycles
+shared_fetch_executor = None
+
+# Thread-pool fetcher: blocking requests, one call per city
+# learned_ids, when given, collects the OpenWeatherMap ID of each response
+def fetch_threaded(cities, emit, learned_ids=None):
     def process_city(index, city):
         city_name = city[1]
         log_to_file(f"Processing ({index + 1}/{len(cities)}): {city_name}")
         try:
-            weather_data = fetch_weather_data(city)
-            if weather_data:
-                weather_main = weather_data["weather"][0]["main"]
-                weather_description = weather_data["weather"][0]["description"]
-                weather_type_id = insert_weather_type(weather_main)
+            with profiled("process_city"):
+                weather_data = fetch_weather_data(city)
+                if weather_data:
+                    if learned_ids is not None and weather_data.get("id"):
+                        learned_ids[city[0]] = weather_data["id"]
+                    emit(city, weather_data)
+        except Exception as e:
+            metrics.incr("fetch_errors")
+            log_to_file(f"Error processing {city_name}: {e}")
 
-                timestamp = weather_data.get("dt")
-                dt_pkt = datetime.fromtimestamp(timestamp, timezone.utc).astimezone(timezone(timedelta(hours=5)))
-                date = dt_pkt.strftime("%Y-%m-%d")
-                time = dt_pkt.strftime("%H:%M:%S")
 
-                if weather_entry_exists(city[0], date, time):
-                    log_to_file(f"Skipping duplicate for {city[1]} on {date} at {time}")
-                    return None
+    if shared_fetch_executor is not None:
+        for future in as_completed([shared_fetch_executor.submit(process_city, i, city) for i, city in enumerate(cities)]):
+            future.result()
+        return
 
-                insert_weather_data_into_db(weather_data, city[0], weather_type_id, weather_description)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for future in as_completed([executor.submit(process_city, i, city) for i, city in enumerate(cities)]):
+            future.result()
 
-                return {
-                    "city_name": city_name,
-                    "temperature_c": weather_data["main"]["temp"],
-                    "humidity_percent": weather_data["main"]["humidity"],
-                    "wind_speed_mps": weather_data["wind"]["speed"],
-                    "weather_main": weather_main,
-                    "weather_description": weather_description,
-                    "date_pkt": datetime.fromtimestamp(weather_data["dt"]).strftime("%Y-%m-%d"),
-                    "time_pkt": datetime.fromtimestamp(weather_data["dt"]).strftime("%H:%M:%S")
-                }
+# Async fetcher: shared aiohttp client, token-bucket rate limit and retries
+def fetch_async(cities, emit):
+    from Weather_AsyncFetch import fetch_weather_data_async
+
+    def on_result(city, weather_data):
+        if weather_data:
+            emit(city, weather_data)
+
+    fetch_weather_data_async(
+        cities, WEATHER_API_URL, API_KEY,
+        calls_per_minute=API_CALLS_PER_MINUTE,
+        concurrency=ASYNC_CONCURRENCY,
+        timeout=HTTP_TIMEOUT_SECONDS,
+        log=log_to_file,
+        on_result=on_result
+    )
+
+# Group fetcher: bulk calls for cities with a known OpenWeatherMap ID,
+# per-city calls for the rest (which also teaches us their IDs for next time)
+def fetch_grouped(cities, emit):
+    id_map = load_owm_id_map()
+
+    # Several of our places can resolve to the same OpenWeatherMap station
+    cities_by_owm_id = {}
+    unmapped = []
+    for city in cities:
+        owm_id = id_map.get(city[0])
+        if owm_id:
+            cities_by_owm_id.setdefault(owm_id, []).append(city)
+        else:
+            unmapped.append(city)
+
+    owm_ids = list(cities_by_owm_id)
+    groups = [owm_ids[i:i + GROUP_SIZE] for i in range(0, len(owm_ids), GROUP_SIZE)]
+
+    def process_group(group):
+        missing = []
+        try:
+            payloads = fetch_weather_group(group)
         except Exception as e:
-            log_to_file(f"Error processing {city_name}: {e}")
+            log_to_file(f"Error fetching weather group: {e}")
+            payloads = None
+        by_id = {payload.get("id"): payload for payload in payloads or []}
+
+        for owm_id in group:
+            weather_data = by_id.get(owm_id)
+            for city in cities_by_owm_id[owm_id]:
+                if weather_data is None:
+                    missing.append(city)
+                else:
+                    emit(city, weather_data)
+        return missing
+
+    fallback = list(unmapped)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for missing in executor.map(process_group, groups):
+            fallback.extend(missing)
+
+    learned_ids = {}
+    if fallback:
+        fetch_threaded(fallback, emit, learned_ids)
+    if learned_ids:
+        id_map.update(learned_ids)
+        save_owm_id_map(id_map)
+
+    log_to_file(
+        f"Group fetch: {len(groups)} group calls for {len(cities) - len(unmapped)} cities, "
+        f"{len(fallback)} per-city fallbacks, {len(learned_ids)} new IDs mapped"
+    )
+
+FETCHERS = {
+    "threads": fetch_threaded,
+    "async": fetch_async,
+    "group": fetch_grouped,
+}
+
+# ---- File sinks ----
+
+# Indented JSON array, written one element at a time
+class JsonSnapshotSink:
+    def __init__(self, path=JSON_EXPORT_PATH):
+        self.path = path
+        self.file = open(path, "w", encoding="utf-8")
+        self.count = 0
+
+    def write(self, record):
+        # Same layout json.dump(records, f, indent=2) produces
+        self.file.write("[\n" if self.count == 0 else ",\n")
+        self.file.write(textwrap.indent(json.dumps(record, indent=2), "  "))
+        self.count += 1
+
+    # Leaves a valid JSON array on disk; the next write() overwrites the closing bracket
+    def flush(self):
+        position = self.file.tell()
+        self.file.write("\n]" if self.count else "[]")
+        self.file.flush()
+        self.file.seek(position)
+
+    def close(self):
+        self.file.write("\n]" if self.count else "[]")
+        self.file.close()
+        print(f"Weather data saved to {self.path}")
+
+# One JSON object per line, appended across runs
+class JsonLinesSink:
+    def __init__(self, path=JSONL_PATH):
+        self.path = path
+        self.file = open(path, "a", encoding="utf-8")
+        self.count = 0
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.count += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+        print(f"Appended {self.count} records to {self.path}")
+
+# CSV output; in append mode the header is only written to a new or empty file
+class CsvSink:
+    def __init__(self, path=CSV_PATH, append=True):
+        self.path = path
+        self.append = append
+        self.write_header = not (append and os.path.exists(path) and os.path.getsize(path) > 0)
+        self.file = open(path, "a" if append else "w", encoding="utf-8", newline="")
+        self.writer = None
+        self.count = 0
+
+    def write(self, record):
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.file, fieldnames=list(record), lineterminator="\n")
+            if self.write_header:
+                self.writer.writeheader()
+        self.writer.writerow(record)
+        self.count += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+        action = "Appended" if self.append else "Saved"
+        print(f"{action} {self.count} cleaned records to {self.path}")
+
+# Parquet files partitioned by date_pkt, e.g. weather_parquet/date_pkt=2025-07-11/part-....parquet
+# Parquet files can't be appended to, so each flush of PARQUET_FLUSH_ROWS records becomes a new part
+class ParquetPartitionSink:
+    def __init__(self, root=PARQUET_DIR, flush_rows=PARQUET_FLUSH_ROWS):
+        self.root = root
+        self.flush_rows = flush_rows
+        self.buffers = {}
+        self.buffered = 0
+        self.parts = 0
+        self.run_id = datetime.now().strftime("%Y%m%d%H%M%S")
+
+    def write(self, record):
+        self.buffers.setdefault(record["date_pkt"], []).append(record)
+        self.buffered += 1
+        if self.buffered >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        for date_pkt, records in self.buffers.items():
+            partition = os.path.join(self.root, f"date_pkt={date_pkt}")
+            os.makedirs(partition, exist_ok=True)
+            part_path = os.path.join(partition, f"part-{self.run_id}-{self.parts:05d}.parquet")
+            pd.DataFrame(records).drop(columns=["date_pkt"]).to_parquet(part_path, index=False)
+            self.parts += 1
+        self.buffers = {}
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        print(f"Wrote {self.parts} parquet parts under {self.root}")
+
+# Fans each record out to several sinks
+class MultiSink:
+    def __init__(self, sinks):
+        self.sinks = sinks
+
+    def write(self, record):
+        for sink in self.sinks:
+            sink.write(record)
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+def build_file_sink(mode=SINK_MODE, export_json=False):
+    if mode == "snapshot":
+        return MultiSink([JsonSnapshotSink(), CsvSink(append=False)])
+
+    if mode == "parquet":
+        sinks = [ParquetPartitionSink()]
+    else:
+        sinks = [JsonLinesSink(), CsvSink(append=True)]
+    if export_json:
+        sinks.append(JsonSnapshotSink())
+    return MultiSink(sinks)
+
+# ---- Raw payload archive ----
+# Every raw API response is kept in a zstd-compressed Parquet store partitioned by
+# PKT date and hour (weather_archive/date=2025-07-11/hour=13/part-....parquet).
+# The schema is fixed so old and new partitions can always be read together;
+# raw_json keeps the full payload for backfilling fields we don't extract yet.
+
+def raw_archive_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("city_id", pa.int64()),
+        ("city_name", pa.string()),
+        ("owm_id", pa.int64()),
+        ("dt", pa.timestamp("s", tz="UTC")),
+        ("fetched_at", pa.timestamp("s", tz="UTC")),
+        ("lat", pa.float64()),
+        ("lon", pa.float64()),
+        ("temp", pa.float64()),
+        ("feels_like", pa.float64()),
+        ("temp_min", pa.float64()),
+        ("temp_max", pa.float64()),
+        ("pressure", pa.float64()),
+        ("humidity", pa.float64()),
+        ("sea_level", pa.float64()),
+        ("grnd_level", pa.float64()),
+        ("visibility", pa.float64()),
+        ("wind_speed", pa.float64()),
+        ("wind_deg", pa.float64()),
+        ("wind_gust", pa.float64()),
+        ("clouds_all", pa.float64()),
+        ("rain_1h", pa.float64()),
+        ("snow_1h", pa.float64()),
+        ("weather_id", pa.int64()),
+        ("weather_main", pa.string()),
+        ("weather_description", pa.string()),
+        ("sunrise", pa.timestamp("s", tz="UTC")),
+        ("sunset", pa.timestamp("s", tz="UTC")),
+        ("timezone_offset", pa.int64()),
+        ("raw_json", pa.string()),
+        ("date", pa.string()),
+        ("hour", pa.int8()),
+    ])
+
+def raw_archive_partitioning():
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    return ds.partitioning(pa.schema([("date", pa.string()), ("hour", pa.int8())]), flavor="hive")
+
+def flatten_raw_payload(city, weather_data, fetched_at):
+    main = weather_data.get("main", {})
+    wind = weather_data.get("wind", {})
+    sys_info = weather_data.get("sys", {})
+    weather = (weather_data.get("weather") or [{}])[0]
+    dt_utc = datetime.fromtimestamp(weather_data.get("dt", 0), timezone.utc)
+    dt_pkt = dt_utc.astimezone(timezone(timedelta(hours=5)))
+
+    def utc(ts):
+        return datetime.fromtimestamp(ts, timezone.utc) if ts is not None else None
+
+    return {
+        "city_id": city[0],
+        "city_name": city[1],
+        "owm_id": weather_data.get("id"),
+        "dt": dt_utc,
+        "fetched_at": fetched_at,
+        "lat": weather_data.get("coord", {}).get("lat"),
+        "lon": weather_data.get("coord", {}).get("lon"),
+        "temp": main.get("temp"),
+        "feels_like": main.get("feels_like"),
+        "temp_min": main.get("temp_min"),
+        "temp_max": main.get("temp_max"),
+        "pressure": main.get("pressure"),
+        "humidity": main.get("humidity"),
+        "sea_level": main.get("sea_level"),
+        "grnd_level": main.get("grnd_level"),
+        "visibility": weather_data.get("visibility"),
+        "wind_speed": wind.get("speed"),
+        "wind_deg": wind.get("deg"),
+        "wind_gust": wind.get("gust"),
+        "clouds_all": weather_data.get("clouds", {}).get("all"),
+        "rain_1h": weather_data.get("rain", {}).get("1h"),
+        "snow_1h": weather_data.get("snow", {}).get("1h"),
+        "weather_id": weather.get("id"),
+        "weather_main": weather.get("main"),
+        "weather_description": weather.get("description"),
+        "sunrise": utc(sys_info.get("sunrise")),
+        "sunset": utc(sys_info.get("sunset")),
+        "timezone_offset": weather_data.get("timezone"),
+        "raw_json": json.dumps(weather_data),
+        "date": dt_pkt.strftime("%Y-%m-%d"),
+        "hour": dt_pkt.hour,
+    }
+
+# Buffers raw payloads and writes them as new Parquet parts every flush_rows records
+class RawPayloadArchive:
+    def __init__(self, root=ARCHIVE_DIR, flush_rows=ARCHIVE_FLUSH_ROWS):
+        import pyarrow  # noqa: F401 - fail at startup, not on the first flush
+        self.root = root
+        self.flush_rows = flush_rows
+        self.rows = []
+        self.flushes = 0
+        self.count = 0
+        self.run_id = datetime.now().strftime("%Y%m%d%H%M%S")
+
+    def write(self, item):
+        city, weather_data = item
+        self.rows.append(flatten_raw_payload(city, weather_data, datetime.now(timezone.utc)))
+        if len(self.rows) >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        table = pa.Table.from_pylist(self.rows, schema=raw_archive_schema())
+        ds.write_dataset(
+            table,
+            self.root,
+            format="parquet",
+            partitioning=raw_archive_partitioning(),
+            basename_template=f"part-{self.run_id}-{self.flushes:05d}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+            file_options=ds.ParquetFileFormat().make_write_options(compression="zstd"),
+        )
+        self.count += len(self.rows)
+        self.flushes += 1
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        log_to_file(f"Raw archive: {self.count} payloads written to {self.root}")
+
+# Read archived payloads back. Date bounds prune whole partitions and the city
+# filter is pushed down to Parquet row-group statistics.
+def read_weather_archive(city_ids=None, start_date=None, end_date=None, columns=None, root=ARCHIVE_DIR):
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(root, format="parquet", schema=raw_archive_schema(),
+                         partitioning=raw_archive_partitioning())
+    predicate = None
+
+    def add(condition):
+        nonlocal predicate
+        predicate = condition if predicate is None else predicate & condition
+
+    if start_date is not None:
+        add(ds.field("date") >= str(start_date))
+    if end_date is not None:
+        add(ds.field("date") <= str(end_date))
+    if city_ids is not None:
+        add(ds.field("city_id").isin(list(city_ids)))
+
+    return dataset.to_table(columns=columns, filter=predicate).to_pandas()
+
+# ---- Freshness cache ----
+# OpenWeatherMap only refreshes station observations every 10-20 minutes, so a city
+# whose last observation is younger than the TTL is skipped before any request is made.
+# The last observation time per city_id lives in a small local SQLite file.
+
+class FreshnessCache:
+    def __init__(self, path=FRESHNESS_DB_PATH, ttl_seconds=FRESHNESS_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.updates = {}
+        self.skipped = 0
+        with sqlite3.connect(path) as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS city_freshness (
+                    city_id INTEGER PRIMARY KEY,
+                    last_dt INTEGER NOT NULL,
+                    checked_at INTEGER NOT NULL
+                )
+            """)
+            self.last_dt = dict(db.execute("SELECT city_id, last_dt FROM city_freshness"))
+
+    # Cities that are due for a new observation
+    def filter_stale(self, cities, now=None):
+        now = now if now is not None else time.time()
+        stale = [city for city in cities if now - self.last_dt.get(city[0], 0) >= self.ttl_seconds]
+        self.skipped = len(cities) - len(stale)
+        return stale
+
+    def record(self, city_id, observed_dt):
+        if observed_dt is None:
+            return
+        with self.lock:
+            self.updates[city_id] = observed_dt
+
+    def save(self):
+        with self.lock:
+            updates = dict(self.updates)
+            self.updates.clear()
+        if not updates:
+            return
+        checked_at = int(time.time())
+        with sqlite3.connect(self.path) as db:
+            db.executemany("""
+                INSERT INTO city_freshness (city_id, last_dt, checked_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT (city_id) DO UPDATE SET last_dt = excluded.last_dt, checked_at = excluded.checked_at
+            """, [(city_id, int(dt), checked_at) for city_id, dt in updates.items()])
+        self.last_dt.update(updates)
+
+# ---- Rollups ----
+# Per-city hourly and daily aggregates, maintained incrementally: after each run only
+# the (city_id, date) days that received new rows are recomputed and upserted.
+
+ROLLUP_AGGREGATES = """
+    MIN(w.temperature_c), MAX(w.temperature_c), AVG(w.temperature_c),
+    MIN(w.humidity_percent), MAX(w.humidity_percent), AVG(w.humidity_percent),
+    MIN(w.wind_speed_mps), MAX(w.wind_speed_mps), AVG(w.wind_speed_mps),
+    MODE() WITHIN GROUP (ORDER BY w.weather_type_id),
+    COUNT(*)
+"""
+
+ROLLUP_COLUMNS = """
+    temp_min_c, temp_max_c, temp_mean_c,
+    humidity_min_percent, humidity_max_percent, humidity_mean_percent,
+    wind_min_mps, wind_max_mps, wind_mean_mps,
+    dominant_weather_type_id,
+    samples
+"""
+
+ROLLUP_UPDATES = """
+    temp_min_c = EXCLUDED.temp_min_c, temp_max_c = EXCLUDED.temp_max_c, temp_mean_c = EXCLUDED.temp_mean_c,
+    humidity_min_percent = EXCLUDED.humidity_min_percent, humidity_max_percent = EXCLUDED.humidity_max_percent,
+    humidity_mean_percent = EXCLUDED.humidity_mean_percent,
+    wind_min_mps = EXCLUDED.wind_min_mps, wind_max_mps = EXCLUDED.wind_max_mps, wind_mean_mps = EXCLUDED.wind_mean_mps,
+    dominant_weather_type_id = EXCLUDED.dominant_weather_type_id,
+    samples = EXCLUDED.samples
+"""
+
+ROLLUP_METRICS_DDL = """
+    temp_min_c REAL, temp_max_c REAL, temp_mean_c REAL,
+    humidity_min_percent REAL, humidity_max_percent REAL, humidity_mean_percent REAL,
+    wind_min_mps REAL, wind_max_mps REAL, wind_mean_mps REAL,
+    dominant_weather_type_id INTEGER,
+    samples INTEGER NOT NULL
+"""
+
+# Also run by migration 4 in Weather_Migrations.py, which backfills the existing history
+def create_rollup_tables(cursor):
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS weather_hourly_rollup (
+            city_id INTEGER NOT NULL,
+            date DATE NOT NULL,
+            hour SMALLINT NOT NULL,
+            {ROLLUP_METRICS_DDL},
+            PRIMARY KEY (city_id, date, hour)
+        );
+        CREATE TABLE IF NOT EXISTS weather_daily_rollup (
+            city_id INTEGER NOT NULL,
+            date DATE NOT NULL,
+            {ROLLUP_METRICS_DDL},
+            PRIMARY KEY (city_id, date)
+        );
+    """)
+
+def ensure_rollup_tables():
+    with pooled_connection() as conn:
+        create_rollup_tables(conn.cursor())
+
+# Recompute the hourly and daily rollups for a sorted list of (city_id, date) days
+def refresh_rollup_days(cursor, days):
+    execute_values(cursor, f"""
+        INSERT INTO weather_hourly_rollup (city_id, date, hour, {ROLLUP_COLUMNS})
+        SELECT w.city_id, w.date, EXTRACT(HOUR FROM w.time)::SMALLINT, {ROLLUP_AGGREGATES}
+        FROM weather_data w
+        JOIN (VALUES %s) AS touched (city_id, date)
+          ON w.city_id = touched.city_id AND w.date = touched.date::DATE
+        GROUP BY w.city_id, w.date, EXTRACT(HOUR FROM w.time)
+        ON CONFLICT (city_id, date, hour) DO UPDATE SET {ROLLUP_UPDATES};
+    """, days, page_size=len(days))
+    execute_values(cursor, f"""
+        INSERT INTO weather_daily_rollup (city_id, date, {ROLLUP_COLUMNS})
+        SELECT w.city_id, w.date, {ROLLUP_AGGREGATES}
+        FROM weather_data w
+        JOIN (VALUES %s) AS touched (city_id, date)
+          ON w.city_id = touched.city_id AND w.date = touched.date::DATE
+        GROUP BY w.city_id, w.date
+        ON CONFLICT (city_id, date) DO UPDATE SET {ROLLUP_UPDATES};
+    """, days, page_size=len(days))
+
+# Recompute the hourly and daily rollups for the (city_id, date) days a run touched
+def refresh_rollups(touched_days):
+    if not touched_days:
+        return 0
+    days = sorted(touched_days)
+
+    with pooled_connection() as conn:
+        refresh_rollup_days(conn.cursor(), days)
+
+    return len(days)
+
+# ---- Streaming pipeline ----
+# fetch -> parse -> dedupe -> load -> file sink, connected by bounded queues
+
+# Marks the end of the stream; each stage forwards it downstream and exits
+STREAM_END = object()
+
+# A stage's input queue that remembers whether the end of the stream has been read
+class StageInput:
+    def __init__(self, in_q):
+        self.in_q = in_q
+        self.ended = False
+
+    def get(self, timeout=None):
+        return self._seen(self.in_q.get(timeout=timeout))
+
+    def get_nowait(self):
+        return self._seen(self.in_q.get_nowait())
+
+    def _seen(self, item):
+        if item is STREAM_END:
+            self.ended = True
+        return item
+
+# Thread target for one stage. Counters go to the stage's own `counts`, merged by the
+# coordinator after join. If the stage dies, the end marker is still sent to its outputs
+# and its input is drained to the end, so no put() upstream or get() downstream blocks
+# forever; the failure is left in `failures` for the coordinator to re-raise.
+def run_stage(name, stage, in_q, outputs, failures, *args):
+    stage_input = StageInput(in_q)
+    try:
+        stage(stage_input, *outputs, *args)
+    except Exception as e:
+        failures.append((name, e))
+        log_to_file(f"Pipeline stage {name} failed: {e}")
+        for out_q in outputs:
+            if out_q is not None:
+                out_q.put(STREAM_END)
+        while not stage_input.ended:
+            stage_input.get()
+
+# Drains up to PARSE_BATCH_SIZE payloads at a time and normalizes them into one frame,
+# also teeing each raw payload into archive_q when archiving is on
+def parse_stage(in_q, out_q, archive_q, counts):
+    done = False
+    while not done:
+        batch = []
+        item = in_q.get()
+        while True:
+            if archive_q is not None:
+                archive_q.put(item)
+            if item is STREAM_END:
+                done = True
+                break
+            batch.append(item)
+            if len(batch) >= PARSE_BATCH_SIZE:
+                break
+            try:
+                item = in_q.get_nowait()
+            except queue.Empty:
+                break
+
+        if batch:
+            with metrics.timer("parse"):
+                frame = normalize_batch(batch, counts)
+            if frame is not None:
+                out_q.put(frame)
+    out_q.put(STREAM_END)
+
+# Normalizes a batch in one pass; if that fails, retries payload by payload so only the
+# bad ones are dropped and counted as parse errors
+def normalize_batch(batch, counts):
+    try:
+        return normalize_weather_payloads(batch)
+    except Exception as e:
+        log_to_file(f"Error normalizing batch of {len(batch)} payloads, retrying one by one: {e}")
+    frames = []
+    for city, weather_data in batch:
+        try:
+            frames.append(normalize_weather_payloads([(city, weather_data)]))
+        except Exception as e:
+            counts["parse_errors"] += 1
+            log_to_file(f"Error normalizing payload for {city[1]}: {e}")
+    if not frames:
         return None
+    return pd.concat(frames, ignore_index=True)
 
+def log_skipped_duplicates(frame):
+    for city_name, date, time in frame[["city_name", "date_pkt", "time_pkt"]].itertuples(index=False, name=None):
+        log_to_file(f"Skipping duplicate for {city_name} on {date} at {time}")
 
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = [executor.submit(process_city, i, city) for i, city in enumerate(cities)]
-        for future in as_completed(futures):
-            result = future.result()
-            if result:
-                structured_data.append(result)
+# Drops observations already seen in this run; the database drops the rest on load
+def dedupe_stage(in_q, out_q, counts):
+    seen = set()
+    while True:
+        frame = in_q.get()
+        if frame is STREAM_END:
+            out_q.put(STREAM_END)
+            return
+        keys = pd.Series(list(frame[KEY_COLUMNS].itertuples(index=False, name=None)), index=frame.index)
+        repeated = keys.duplicated() | keys.isin(seen)
+        if repeated.any():
+            counts["duplicates"] += int(repeated.sum())
+            log_skipped_duplicates(frame[repeated])
+        seen.update(keys[~repeated])
+        if not repeated.all():
+            out_q.put(frame[~repeated])
 
-    return structured_data
+# Loads observations in batches of batch_size, flushing early when the stream goes quiet.
+# The (city_id, date) of every new row is added to touched_days for the rollup refresh,
+# and only rows the database reports as inserted mark their city fresh. Every city whose
+# observation is now in the database, new or duplicate, is added to loaded_cities.
+def load_stage(in_q, out_q, counts, batch_size, touched_days, loaded_cities, freshness=None):
+    frames = []
+    buffered = 0
+
+    def flush():
+        nonlocal frames, buffered
+        if not frames:
+            return
+        batch = pd.concat(frames, ignore_index=True)
+        frames, buffered = [], 0
+        try:
+            with metrics.timer("load"):
+                inserted = insert_weather_data_bulk(frame_to_db_rows(batch), batch_size)
+        except Exception as e:
+            counts["load_errors"] += len(batch)
+            log_to_file(f"Bulk insert of {len(batch)} rows failed: {e}")
+            return
+        is_new = pd.Series(
+            [key in inserted for key in batch[KEY_COLUMNS].itertuples(index=False, name=None)],
+            index=batch.index
+        )
+        counts["inserted"] += int(is_new.sum())
+        counts["duplicates"] += int((~is_new).sum())
+        loaded_cities.update(batch["city_id"].tolist())
+        log_skipped_duplicates(batch[~is_new])
+        if is_new.any():
+            touched_days.update(batch.loc[is_new, ["city_id", "date_pkt"]].itertuples(index=False, name=None))
+            if freshness is not None:
+                for city_id, observed_dt in batch.loc[is_new, ["city_id", "dt"]].itertuples(index=False, name=None):
+                    freshness.record(int(city_id), int(observed_dt))
+            out_q.put(batch[is_new])
+
+    while True:
+        try:
+            frame = in_q.get(timeout=LOAD_FLUSH_SECONDS)
+        except queue.Empty:
+            flush()
+            continue
+        if frame is STREAM_END:
+            flush()
+            out_q.put(STREAM_END)
+            return
+        frames.append(frame)
+        buffered += len(frame)
+        if buffered >= batch_size:
+            flush()
+
+# Writes loaded frames to the file sinks record by record; a sink the caller keeps
+# open across runs (close_sink=False) is only flushed at the end
+def sink_stage(in_q, sink, close_sink=True):
+    try:
+        while True:
+            frame = in_q.get()
+            if frame is STREAM_END:
+                return
+            try:
+                for record in frame_to_records(frame):
+                    sink.write(record)
+            except Exception as e:
+                log_to_file(f"Error writing to {type(sink).__name__}: {e}")
+    finally:
+        if close_sink:
+            sink.close()
+        else:
+            sink.flush()
+
+# Writes raw (city, payload) pairs to the payload archive
+def archive_stage(in_q, archive):
+    try:
+        while True:
+            item = in_q.get()
+            if item is STREAM_END:
+                return
+            try:
+                archive.write(item)
+            except Exception as e:
+                log_to_file(f"Error archiving payload for {item[0][1]}: {e}")
+    finally:
+        archive.close()
+
+# A caller running repeatedly (the scheduler) passes its own long-lived freshness cache
+# and sink, with close_sink=False so the sink stays open between runs.
+# Returns the stage counters plus loaded_city_ids, the cities whose observation is in the database.
+def fetch_weather_data_parallel(cities, batch_size=BULK_BATCH_SIZE, fetch_mode=FETCH_MODE,
+                                queue_size=QUEUE_SIZE, sink=None, archive_raw=ARCHIVE_RAW,
+                                freshness_ttl=FRESHNESS_TTL_SECONDS, update_rollups=UPDATE_ROLLUPS,
+                                freshness=None, close_sink=True):
+    log_to_file("==== New ETL Run Started ====\n")
+    log_to_file(f"Fetch mode: {fetch_mode}")
+
+    if freshness is None and freshness_ttl > 0:
+        freshness = FreshnessCache(ttl_seconds=freshness_ttl)
+    if freshness is not None:
+        total_cities = len(cities)
+        cities = freshness.filter_stale(cities)
+        log_to_file(
+            f"Freshness cache: {freshness.skipped}/{total_cities} cities observed within "
+            f"{freshness.ttl_seconds}s, {freshness.skipped} API calls saved"
+        )
+
+    stats = Counter({"fetched": 0, "inserted": 0, "duplicates": 0, "parse_errors": 0, "load_errors": 0})
+    parse_counts, dedupe_counts, load_counts = Counter(), Counter(), Counter()
+    failures = []
+    touched_days = set()
+    loaded_cities = set()
+    fetched_q = queue.Queue(maxsize=queue_size)
+    parsed_q = queue.Queue(maxsize=queue_size)
+    unique_q = queue.Queue(maxsize=queue_size)
+    loaded_q = queue.Queue(maxsize=queue_size)
+    if sink is None:
+        sink = build_file_sink()
+
+    archive_q = None
+    if archive_raw:
+        try:
+            archive = RawPayloadArchive()
+            archive_q = queue.Queue(maxsize=queue_size)
+        except ImportError as e:
+            log_to_file(f"Raw archive disabled: {e}")
+
+    stage_specs = [
+        ("parse", parse_stage, fetched_q, (parsed_q, archive_q), (parse_counts,)),
+        ("dedupe", dedupe_stage, parsed_q, (unique_q,), (dedupe_counts,)),
+        ("load", load_stage, unique_q, (loaded_q,), (load_counts, batch_size, touched_days, loaded_cities, freshness)),
+        ("sink", sink_stage, loaded_q, (), (sink, close_sink)),
+    ]
+    if archive_q is not None:
+        stage_specs.append(("archive", archive_stage, archive_q, (), (archive,)))
+    stages = [
+        threading.Thread(target=run_stage, args=(name, stage, in_q, outputs, failures, *args), name=f"etl-{name}")
+        for name, stage, in_q, outputs, args in stage_specs
+    ]
+    for stage in stages:
+        stage.start()
+
+    fetch_lock = threading.Lock()
+
+    def emit(city, weather_data):
+        with fetch_lock:
+            stats["fetched"] += 1
+        fetched_q.put((city, weather_data))
+
+    try:
+        FETCHERS.get(fetch_mode, fetch_threaded)(cities, emit)
+    finally:
+        fetched_q.put(STREAM_END)
+        for stage in stages:
+            stage.join()
+        if freshness is not None:
+            freshness.save()
+        for counts in (parse_counts, dedupe_counts, load_counts):
+            stats.update(counts)
+
+    if update_rollups:
+        try:
+            ensure_rollup_tables()
+            with metrics.timer("rollups"):
+                refreshed = refresh_rollups(touched_days)
+            log_to_file(f"Rollups: refreshed hourly and daily aggregates for {refreshed} city-days")
+        except Exception as e:
+            log_to_file(f"Rollup refresh failed: {e}")
+
+    log_to_file(
+        f"Pipeline: {stats['fetched']} fetched, {stats['inserted']} inserted, "
+        f"{stats['duplicates']} duplicates skipped, "
+        f"{stats['parse_errors']} parse errors, {stats['load_errors']} load errors"
+    )
+    for name, value in stats.items():
+        metrics.incr(name, value)
+    stats["loaded_city_ids"] = loaded_cities
+    if failures:
+        name, error = failures[0]
+        raise RuntimeError(f"ETL pipeline stage {name} failed") from error
+    return stats
+
+# ---- Resident scheduler ----
+# One process keeps the DB pool, weather type cache, fetch threads and HTTP sessions warm
+# and polls each city at the interval of its population tier, within a global API budget.
+
+# "100000:600,0:3600" -> [(100000, 600), (0, 3600)], largest population first
+def parse_tiers(spec=SCHEDULER_TIERS):
+    tiers = []
+    for part in spec.split(","):
+        min_population, interval = part.strip().split(":")
+        tiers.append((int(min_population), int(interval)))
+    return sorted(tiers, reverse=True)
+
+# Takes cities in order while the API calls they need still fit in allowed_calls; returns (batch, calls).
+# In group mode cities with a known OpenWeatherMap id share one call per GROUP_SIZE ids, while
+# unmapped cities fall back to one call each, so the two are counted separately.
+def select_within_budget(cities, allowed_calls, fetch_mode, id_map):
+    if fetch_mode != "group":
+        batch = cities[:max(0, int(allowed_calls))]
+        return batch, len(batch)
+
+    owm_ids = set()
+    unmapped = 0
+    batch = []
+    for city in cities:
+        owm_id = id_map.get(city[0])
+        group_ids = len(owm_ids) + (1 if owm_id and owm_id not in owm_ids else 0)
+        calls = (group_ids + GROUP_SIZE - 1) // GROUP_SIZE + unmapped + (0 if owm_id else 1)
+        if calls > allowed_calls:
+            continue
+        if owm_id:
+            owm_ids.add(owm_id)
+        else:
+            unmapped += 1
+        batch.append(city)
+    return batch, (len(owm_ids) + GROUP_SIZE - 1) // GROUP_SIZE + unmapped
+
+# Tracks when each city is next due. Due cities are taken highest tier first, then most overdue,
+# so a backlog left by a slow cycle or a small budget is caught up in priority order.
+# A city whose fetch or load failed is retried after retry_seconds, doubling per failure
+# up to its tier interval.
+class PollScheduler:
+    def __init__(self, tiers, jitter=SCHEDULER_JITTER, retry_seconds=SCHEDULER_TICK_SECONDS, rng=None):
+        self.tiers = tiers
+        self.jitter = jitter
+        self.retry_seconds = retry_seconds
+        self.rng = rng or random.Random()
+        self.cities = {}
+        self.tier_of = {}
+        self.next_due = {}
+        self.failures = {}
+
+    def tier_index(self, population):
+        for index, (min_population, _) in enumerate(self.tiers):
+            if population is not None and population >= min_population:
+                return index
+        return len(self.tiers) - 1
+
+    # New cities are due immediately, removed ones are dropped, known ones keep their schedule
+    def update_cities(self, cities, populations, now):
+        self.cities = {city[0]: city for city in cities}
+        self.tier_of = {city_id: self.tier_index(populations.get(city_id)) for city_id in self.cities}
+        self.next_due = {city_id: self.next_due.get(city_id, now) for city_id in self.cities}
+        self.failures = {city_id: count for city_id, count in self.failures.items() if city_id in self.cities}
+
+    # All due cities in priority order
+    def due(self, now):
+        due_ids = [city_id for city_id, due_at in self.next_due.items() if due_at <= now]
+        due_ids.sort(key=lambda city_id: (self.tier_of[city_id], self.next_due[city_id]))
+        return [self.cities[city_id] for city_id in due_ids]
+
+    def interval(self, city_id):
+        return self.tiers[self.tier_of[city_id]][1]
+
+    def mark_polled(self, cities, now):
+        for city in cities:
+            if city[0] in self.next_due:
+                self.failures.pop(city[0], None)
+                self.next_due[city[0]] = now + self.interval(city[0]) * (1 + self.rng.uniform(0, self.jitter))
+
+    def mark_failed(self, cities, now):
+        for city in cities:
+            if city[0] in self.next_due:
+                failures = self.failures.get(city[0], 0) + 1
+                self.failures[city[0]] = failures
+                delay = min(self.retry_seconds * 2 ** (failures - 1), self.interval(city[0]))
+                self.next_due[city[0]] = now + delay
+
+    def tier_sizes(self):
+        sizes = [0] * len(self.tiers)
+        for index in self.tier_of.values():
+            sizes[index] += 1
+        return sizes
+
+# Starts Weather_Prediction.py in the background once enough new rows have been loaded.
+# Never runs two forecasts at once and never more often than min_interval.
+class ForecastTrigger:
+    def __init__(self, min_rows=FORECAST_TRIGGER_ROWS, min_interval=FORECAST_MIN_INTERVAL_SECONDS,
+                 args=FORECAST_ARGS):
+        self.min_rows = min_rows
+        self.min_interval = min_interval
+        self.args = shlex.split(args)
+        self.new_rows = 0
+        self.last_started = None
+        self.process = None
+
+    def add(self, rows):
+        self.new_rows += rows
+
+    def running(self):
+        if self.process is None:
+            return False
+        if self.process.poll() is None:
+            return True
+        log_to_file(f"Forecast run finished with exit code {self.process.returncode}")
+        self.process = None
+        return False
+
+    def maybe_start(self, now):
+        if self.min_rows <= 0 or self.running() or self.new_rows < self.min_rows:
+            return False
+        if self.last_started is not None and now - self.last_started < self.min_interval:
+            return False
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Weather_Prediction.py")
+        self.process = subprocess.Popen([sys.executable, script] + self.args)
+        log_to_file(f"Started forecast run after {self.new_rows} new rows (pid {self.process.pid})")
+        self.new_rows = 0
+        self.last_started = now
+        return True
+
+    def stop(self):
+        if self.running():
+            self.process.wait()
+
+# HTTP requests made since the last metrics.reset(), as counted by the fetchers
+def api_calls_made():
+    counters = metrics.snapshot()["counters"]
+    return counters.get("http_ok", 0) + counters.get("http_failed", 0) + counters.get("http_retries", 0)
+
+# One scheduling cycle under the run lock: refresh the city list when it is due, drop due cities
+# the freshness cache already covers, then poll as many of the rest as the budget allows.
+# Returns the API calls spent, or None when another run held the lock.
+def run_scheduler_cycle(state, now, allowed_calls):
+    options = state["options"]
+    with etl_run_lock() as acquired:
+        if not acquired:
+            log_to_file("Skipped cycle: another ETL run holds the run lock")
+            return None
+
+        if state["partitions_checked_on"] != date.today():
+            ensure_weather_partitions()
+            state["partitions_checked_on"] = date.today()
+
+        scheduler = state["scheduler"]
+        if state["cities_loaded_at"] is None or now - state["cities_loaded_at"] >= SCHEDULER_CITY_REFRESH_SECONDS:
+            cities = fetch_cities_from_db()
+            if options["thin_radius_km"] > 0:
+                cities = thin_cities(cities, options["thin_radius_km"])
+            scheduler.update_cities(cities, fetch_city_populations(), now)
+            state["cities_loaded_at"] = now
+            log_to_file(f"Scheduler cities per tier: {scheduler.tier_sizes()}")
+
+        due = scheduler.due(now)
+        stale = due
+        if state["freshness"] is not None:
+            stale = state["freshness"].filter_stale(due, now)
+        id_map = load_owm_id_map() if options["fetch_mode"] == "group" else {}
+        batch, planned_calls = select_within_budget(stale, allowed_calls, options["fetch_mode"], id_map)
+
+        spent = 0
+        if batch:
+            stats = fetch_weather_data_parallel(batch, fetch_mode=options["fetch_mode"],
+                                                sink=state["sink"], close_sink=False,
+                                                archive_raw=options["archive_raw"],
+                                                freshness=state["freshness"],
+                                                update_rollups=options["update_rollups"])
+            loaded = stats["loaded_city_ids"]
+            scheduler.mark_polled([city for city in batch if city[0] in loaded], now)
+            scheduler.mark_failed([city for city in batch if city[0] not in loaded], now)
+            state["trigger"].add(stats["inserted"])
+            spent = max(planned_calls, api_calls_made())
+            metrics.incr("cities_failed", len(batch) - len(loaded))
+
+        metrics.incr("cities_due", len(due))
+        metrics.incr("cities_fresh", len(due) - len(stale))
+        metrics.incr("cities_polled", len(batch))
+        metrics.incr("cities_deferred", len(stale) - len(batch))
+        metrics.incr("api_calls_spent", spent)
+        log_pool_stats()
+        log_run_metrics("scheduler_cycle", fetch_mode=options["fetch_mode"])
+        return spent
+
+def run_scheduler(fetch_mode=FETCH_MODE, sink_mode=SINK_MODE, archive_raw=ARCHIVE_RAW,
+                  freshness_ttl=FRESHNESS_TTL_SECONDS, update_rollups=UPDATE_ROLLUPS,
+                  thin_radius_km=THIN_RADIUS_KM, tiers=None, tick_seconds=SCHEDULER_TICK_SECONDS,
+                  api_budget=SCHEDULER_API_BUDGET, max_cycles=None):
+    global shared_fetch_executor
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop.set())
+
+    # Everything that stays warm between cycles
+    state = {
+        "options": {"fetch_mode": fetch_mode, "archive_raw": archive_raw,
+                    "update_rollups": update_rollups, "thin_radius_km": thin_radius_km},
+        "scheduler": PollScheduler(tiers or parse_tiers(), retry_seconds=tick_seconds),
+        "trigger": ForecastTrigger(),
+        "freshness": FreshnessCache(ttl_seconds=freshness_ttl) if freshness_ttl > 0 else None,
+        "sink": build_file_sink(sink_mode),
+        "cities_loaded_at": None,
+        "partitions_checked_on": None,
+    }
+    shared_fetch_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="etl-fetch")
+    log_to_file(f"Scheduler started: tiers {state['scheduler'].tiers}, tick {tick_seconds}s, "
+                f"budget {api_budget} calls/min")
+
+    # API budget as a token bucket holding at most one minute of calls, so a long stall does
+    # not turn into a burst; a cycle that overspends (e.g. group fallbacks) borrows from the next
+    credit = api_budget * min(tick_seconds, 60) / 60
+    last_refill = time.monotonic()
+    started_up = False
+    failures = 0
+    next_tick = time.monotonic()
+    cycles = 0
+    try:
+        while not stop.is_set() and (max_cycles is None or cycles < max_cycles):
+            started = time.monotonic()
+            credit = min(credit + api_budget * (started - last_refill) / 60, api_budget)
+            last_refill = started
+            metrics.reset()
+            reset_pool_stats()
+
+            try:
+                if not started_up:
+                    if not check_upsert_keys():
+                        return False
+                    load_weather_type_cache()
+                    started_up = True
+                spent = run_scheduler_cycle(state, time.time(), int(max(credit, 0)))
+                if spent is not None:
+                    credit -= spent
+                state["trigger"].maybe_start(time.time())
+                failures = 0
+            except Exception as e:
+                # A database or network outage must not end the daemon: log it, drop the pool so
+                # the next cycle reconnects, and back off while the failures continue
+                failures += 1
+                credit -= api_calls_made()
+                log_to_file(f"Scheduler cycle failed ({failures} in a row): {type(e).__name__}: {e}")
+                close_db_pool()
+            cycles += 1
+
+            # Ticks missed while a cycle overran are coalesced into one; the deferred cities
+            # stay due and are caught up first. A little jitter keeps ticks off round seconds.
+            if failures:
+                next_tick = time.monotonic() + min(tick_seconds * 2 ** (failures - 1), SCHEDULER_MAX_BACKOFF_SECONDS)
+            else:
+                next_tick += tick_seconds
+                now_mono = time.monotonic()
+                if now_mono > next_tick:
+                    missed = int((now_mono - next_tick) // tick_seconds) + 1
+                    log_to_file(f"Cycle took {now_mono - started:.1f}s, skipping {missed} missed tick(s)")
+                    next_tick = now_mono
+            stop.wait(max(0.0, next_tick - time.monotonic()) + random.uniform(0, SCHEDULER_JITTER * tick_seconds))
+        return True
+    finally:
+        log_to_file("Scheduler stopping")
+        state["trigger"].stop()
+        state["sink"].close()
+        shared_fetch_executor.shutdown(wait=True)
+        shared_fetch_executor = None
+        log_weather_type_stats()
+        close_db_pool()
+        log_writer.close()
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Fetch weather for all cities and load it into PostgreSQL")
+    parser.add_argument("--fetch-mode", choices=["threads", "async", "group"], default=FETCH_MODE,
+                        help="HTTP fetch engine (default: %(default)s)")
+    parser.add_argument("--sink-mode", choices=["append", "parquet", "snapshot"], default=SINK_MODE,
+                        help="File output format (default: %(default)s)")
+    parser.add_argument("--export-json", action="store_true",
+                        help=f"Also write the indented {JSON_EXPORT_PATH} export")
+    parser.add_argument("--no-archive-raw", dest="archive_raw", action="store_false", default=ARCHIVE_RAW,
+                        help=f"Skip writing raw API payloads to {ARCHIVE_DIR}")
+    parser.add_argument("--freshness-ttl", type=int, default=FRESHNESS_TTL_SECONDS,
+                        help="Skip cities observed within this many seconds, 0 to fetch all (default: %(default)s)")
+    parser.add_argument("--no-rollups", dest="update_rollups", action="store_false", default=UPDATE_ROLLUPS,
+                        help="Skip refreshing the hourly/daily rollup tables")
+    parser.add_argument("--thin-radius-km", type=float, default=THIN_RADIUS_KM,
+                        help="Poll one representative city per cluster of this radius, 0 for all (default: %(default)s)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Write cProfile dumps of the per-city hot path to METRICS_PROFILE_DIR")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Stay resident and poll cities by population tier instead of running once")
+    parser.add_argument("--tiers", default=SCHEDULER_TIERS,
+                        help="--daemon poll tiers as min_population:seconds pairs (default: %(default)s)")
+    parser.add_argument("--tick", type=int, default=SCHEDULER_TICK_SECONDS,
+                        help="--daemon seconds between scheduling ticks (default: %(default)s)")
+    parser.add_argument("--api-budget", type=int, default=SCHEDULER_API_BUDGET,
+                        help="--daemon API calls allowed per minute across all tiers (default: %(default)s)")
+    args = parser.parse_args()
+    if args.daemon:
+        set_profiling(args.profile)
+        ok = run_scheduler(fetch_mode=args.fetch_mode, sink_mode=args.sink_mode, archive_raw=args.archive_raw,
+                           freshness_ttl=args.freshness_ttl, update_rollups=args.update_rollups,
+                           thin_radius_km=args.thin_radius_km, tiers=parse_tiers(args.tiers),
+                           tick_seconds=args.tick, api_budget=args.api_budget)
+        raise SystemExit(0 if ok else 1)
+    ok = main(fetch_mode=args.fetch_mode, sink_mode=args.sink_mode, export_json=args.export_json,
+              archive_raw=args.archive_raw, freshness_ttl=args.freshness_ttl, update_rollups=args.update_rollups,
+              thin_radius_km=args.thin_radius_km, profile=args.profile)
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,4 @@
+@echo off
+REM Resident scheduler: start once (e.g. at logon) instead of scheduling Weather_ETL.bat
+"C:\Users\AbubakarDar\python.exe" "D:\Weather ETL Pipeline Project\Weather_ETL_DB.py" --daemon
+pause
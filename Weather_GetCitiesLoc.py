@@ -1,66 +1,216 @@
 import psycopg2
 from dotenv import load_dotenv
 import os
+import io
+import csv
+import json
+import time
+import argparse
 import requests
 
 load_dotenv()
 
+GEONAMES_URL = "http://api.geonames.org/searchJSON"
+# GeoNames returns at most 1000 rows per request; larger loads are paged with startRow
+GEONAMES_PAGE_SIZE = 1000
+CITY_MAX_ROWS = int(os.getenv("CITY_MAX_ROWS", "700"))
+
+STAGING_COLUMNS = ["geonames_id", "city_name", "latitude", "longitude", "country", "region", "population"]
+
+
 # DB connection
-conn = psycopg2.connect(
-    dbname=os.getenv("DB_NAME"),
-    user=os.getenv("DB_USER"),
-    password=os.getenv("DB_PASSWORD"),
-    host=os.getenv("DB_HOST"),
-    port=os.getenv("DB_PORT")
-)
-cur = conn.cursor()
-
-# Fetch from API
-url = "http://api.geonames.org/searchJSON"
-params = {
-    "country": "PK",                   # Restrict to Pakistan
-    "maxRows": 700,
-    "orderby": "population",
-    "featureClass": "P",              # 'P' = Populated place
-    "username": os.getenv("GEONAMES_USERNAME")
-}
-response = requests.get(url, params=params)
-data = response.json()
-
-cities = data.get("geonames", [])
-insert_count = 0
-update_count = 0
-
-for city in cities:
-    city_name = city.get("name")
-    lat = round(float(city.get("lat")), 5)
-    lon = round(float(city.get("lng")), 5)
-    country = city.get("countryName")
-    region = city.get("adminName1")
-
-    # Match by city_name + lat + lon
-    cur.execute("""
-        SELECT city_id FROM cities
-        WHERE city_name = %s AND latitude = %s AND longitude = %s;
-    """, (city_name, lat, lon))
-    
-    result = cur.fetchone()
+def get_db_connection():
+    return psycopg2.connect(
+        dbname=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT")
+    )
+
+# Fetch from API, most populous first, one page at a time until max_rows places are collected
+def fetch_geonames_places(max_rows=CITY_MAX_ROWS, page_size=GEONAMES_PAGE_SIZE):
+    session = requests.Session()
+    places = []
+    while len(places) < max_rows:
+        params = {
+            "country": "PK",                   # Restrict to Pakistan
+            "maxRows": min(page_size, max_rows - len(places)),
+            "startRow": len(places),
+            "orderby": "population",
+            "featureClass": "P",              # 'P' = Populated place
+            "username": os.getenv("GEONAMES_USERNAME")
+        }
+        response = session.get(GEONAMES_URL, params=params, timeout=30)
+        response.raise_for_status()
+        data = response.json()
+        if "status" in data:
+            raise RuntimeError(f"GeoNames error: {data['status'].get('message')}")
+        page = data.get("geonames", [])
+        places.extend(page)
+        if len(page) < params["maxRows"] or len(places) >= data.get("totalResultsCount", 0):
+            break
+    return places[:max_rows]
+
+# Places from a saved searchJSON response such as pakistan_cities_raw.json
+def load_places_from_file(path, max_rows=CITY_MAX_ROWS):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return data.get("geonames", [])[:max_rows]
+
+def place_to_row(place):
+    return (
+        place.get("geonameId"),
+        place.get("name"),
+        round(float(place.get("lat")), 5),
+        round(float(place.get("lng")), 5),
+        place.get("countryName"),
+        place.get("adminName1"),
+        place.get("population"),
+    )
 
-    if result:
+
+# Original loader: one SELECT plus one UPDATE or INSERT per place
+def sync_cities_rowwise(conn, places):
+    cur = conn.cursor()
+    insert_count = 0
+    update_count = 0
+
+    for city in places:
+        city_name = city.get("name")
+        lat = round(float(city.get("lat")), 5)
+        lon = round(float(city.get("lng")), 5)
+        country = city.get("countryName")
+        region = city.get("adminName1")
+
+        # Match by city_name + lat + lon
         cur.execute("""
-            UPDATE cities
-            SET region = %s, country = %s
+            SELECT city_id FROM cities
             WHERE city_name = %s AND latitude = %s AND longitude = %s;
-        """, (region, country, city_name, lat, lon))
-        update_count += 1
-    else:
+        """, (city_name, lat, lon))
+
+        result = cur.fetchone()
+
+        if result:
+            cur.execute("""
+                UPDATE cities
+                SET region = %s, country = %s
+                WHERE city_name = %s AND latitude = %s AND longitude = %s;
+            """, (region, country, city_name, lat, lon))
+            update_count += 1
+        else:
+            cur.execute("""
+                INSERT INTO cities (city_name, latitude, longitude, country, region)
+                VALUES (%s, %s, %s, %s, %s);
+            """, (city_name, lat, lon, country, region))
+            insert_count += 1
+
+    conn.commit()
+    return {"inserted": insert_count, "updated": update_count}
+
+def has_geonames_ids(cur):
+    cur.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'cities' AND column_name = 'geonames_id'
+        );
+    """)
+    return cur.fetchone()[0]
+
+# COPY all places into a temp staging table, then merge into cities in one statement keyed on geonames_id
+def sync_cities_bulk(conn, places):
+    rows = [place_to_row(place) for place in places if place.get("geonameId") is not None]
+    with conn.cursor() as cur:
+        if not has_geonames_ids(cur):
+            raise RuntimeError("cities.geonames_id is missing; run `python Weather_Migrations.py migrate` first")
+
+        cur.execute("""
+            CREATE TEMP TABLE city_staging (
+                geonames_id BIGINT,
+                city_name TEXT,
+                latitude NUMERIC,
+                longitude NUMERIC,
+                country TEXT,
+                region TEXT,
+                population BIGINT
+            ) ON COMMIT DROP;
+        """)
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cur.copy_expert(f"COPY city_staging ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+        # Cities loaded before geonames_id existed: adopt the id where name and coordinates still match.
+        # Only the lowest city_id of any duplicate rows takes an id, so the unique index holds;
+        # the other copies are left without one.
         cur.execute("""
-            INSERT INTO cities (city_name, latitude, longitude, country, region)
-            VALUES (%s, %s, %s, %s, %s);
-        """, (city_name, lat, lon, country, region))
-        insert_count += 1
+            UPDATE cities c
+            SET geonames_id = matched.geonames_id
+            FROM (
+                SELECT DISTINCT ON (s.geonames_id) s.geonames_id, existing.city_id
+                FROM city_staging s
+                JOIN cities existing
+                  ON existing.geonames_id IS NULL
+                 AND existing.city_name = s.city_name AND existing.latitude = s.latitude AND existing.longitude = s.longitude
+                WHERE NOT EXISTS (SELECT 1 FROM cities taken WHERE taken.geonames_id = s.geonames_id)
+                ORDER BY s.geonames_id, existing.city_id
+            ) matched
+            WHERE c.city_id = matched.city_id;
+        """)
+        adopted = cur.rowcount
 
-conn.commit()
-conn.close()
+        # Unchanged rows are filtered by the WHERE and so are not returned
+        cur.execute("""
+            INSERT INTO cities (geonames_id, city_name, latitude, longitude, country, region, population)
+            SELECT DISTINCT ON (geonames_id) geonames_id, city_name, latitude, longitude, country, region, population
+            FROM city_staging
+            ORDER BY geonames_id
+            ON CONFLICT (geonames_id) DO UPDATE
+            SET city_name = EXCLUDED.city_name,
+                latitude = EXCLUDED.latitude,
+                longitude = EXCLUDED.longitude,
+                country = EXCLUDED.country,
+                region = EXCLUDED.region,
+                population = EXCLUDED.population
+            WHERE (cities.city_name, cities.latitude, cities.longitude, cities.country, cities.region, cities.population)
+                  IS DISTINCT FROM
+                  (EXCLUDED.city_name, EXCLUDED.latitude, EXCLUDED.longitude, EXCLUDED.country, EXCLUDED.region, EXCLUDED.population)
+            RETURNING (xmax = 0) AS inserted;
+        """)
+        changed = [row[0] for row in cur.fetchall()]
+        cur.execute("SELECT COUNT(DISTINCT geonames_id) FROM city_staging;")
+        staged = cur.fetchone()[0]
+    conn.commit()
+
+    inserted = sum(changed)
+    updated = len(changed) - inserted
+    return {"inserted": inserted, "updated": updated, "unchanged": staged - len(changed), "adopted": adopted}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load populated places in Pakistan from GeoNames into the cities table")
+    parser.add_argument("--mode", choices=["bulk", "rowwise"], default="bulk",
+                        help="bulk: COPY + one merge keyed on geonames_id; rowwise: original per-place queries")
+    parser.add_argument("--max-rows", type=int, default=CITY_MAX_ROWS, help="Places to load (default: %(default)s)")
+    parser.add_argument("--from-file", help="Read a saved searchJSON response instead of calling GeoNames")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.from_file:
+        places = load_places_from_file(args.from_file, args.max_rows)
+    else:
+        places = fetch_geonames_places(args.max_rows)
+    fetched = time.perf_counter()
 
-print(f"Updated {update_count} cities and inserted {insert_count} new ones.")
+    conn = get_db_connection()
+    try:
+        if args.mode == "bulk":
+            counts = sync_cities_bulk(conn, places)
+            print(f"Inserted {counts['inserted']}, updated {counts['updated']} and left {counts['unchanged']} "
+                  f"cities unchanged ({counts['adopted']} existing cities matched to GeoNames ids).")
+        else:
+            counts = sync_cities_rowwise(conn, places)
+            print(f"Updated {counts['updated']} cities and inserted {counts['inserted']} new ones.")
+    finally:
+        conn.close()
+    print(f"Fetched {len(places)} places in {fetched - started:.2f}s, synced in {time.perf_counter() - fetched:.2f}s")
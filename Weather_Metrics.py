@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import queue
+import atexit
+import cProfile
+import pstats
+import threading
+import functools
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+
+# One JSON summary per run is appended here
+METRICS_PATH = os.getenv("METRICS_PATH", "weather_metrics.jsonl")
+# cProfile dumps of the hot paths, enabled with METRICS_PROFILE=1 or the scripts' --profile flag
+PROFILE_ENABLED = os.getenv("METRICS_PROFILE", "0") == "1"
+PROFILE_DIR = os.getenv("METRICS_PROFILE_DIR", "profiles")
+LOG_FLUSH_SECONDS = float(os.getenv("LOG_FLUSH_SECONDS", "1"))
+
+
+# Log writer that never blocks the caller on disk: messages are timestamped and queued,
+# and one background thread appends them to the file in batches through a single open handle
+class BufferedLogWriter:
+    def __init__(self, path, flush_seconds=LOG_FLUSH_SECONDS):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.messages = queue.SimpleQueue()
+        self.thread = None
+        self.start_lock = threading.Lock()
+        atexit.register(self.close)
+
+    def write(self, message):
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.messages.put(f"[{timestamp}] {message}\n")
+        if self.thread is None:
+            self._start()
+
+    def _start(self):
+        with self.start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        with open(self.path, "a", encoding="utf-8") as log_file:
+            stopping = False
+            while not stopping:
+                try:
+                    lines = [self.messages.get(timeout=self.flush_seconds)]
+                except queue.Empty:
+                    continue
+                while True:
+                    try:
+                        lines.append(self.messages.get_nowait())
+                    except queue.Empty:
+                        break
+                if None in lines:
+                    stopping = True
+                    lines = [line for line in lines if line is not None]
+                log_file.writelines(lines)
+                log_file.flush()
+
+    # Writes everything queued so far and stops the writer; a later write() starts a new one
+    def close(self):
+        with self.start_lock:
+            if self.thread is None:
+                return
+            self.messages.put(None)
+            self.thread.join()
+            self.thread = None
+
+
+# Thread-safe per-stage timings and counters for one process
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.timings = defaultdict(list)
+            self.counters = defaultdict(int)
+            self.started = time.time()
+
+    def record(self, stage, seconds):
+        with self.lock:
+            self.timings[stage].append(seconds)
+
+    def incr(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] += amount
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    # Raw timings and counters, e.g. to send back from a worker process; reset=True starts afresh
+    def snapshot(self, reset=False):
+        with self.lock:
+            snapshot = {
+                "timings": {stage: list(values) for stage, values in self.timings.items()},
+                "counters": dict(self.counters),
+            }
+            if reset:
+                self.timings = defaultdict(list)
+                self.counters = defaultdict(int)
+        return snapshot
+
+    def merge(self, snapshot):
+        with self.lock:
+            for stage, values in snapshot["timings"].items():
+                self.timings[stage].extend(values)
+            for counter, amount in snapshot["counters"].items():
+                self.counters[counter] += amount
+
+    # Count, total and p50/p95/p99/max latency (ms) per stage, plus counters
+    def summary(self, run=None, **extra):
+        snapshot = self.snapshot()
+        stages = {}
+        for stage, values in sorted(snapshot["timings"].items()):
+            millis = np.asarray(values) * 1000
+            p50, p95, p99 = np.percentile(millis, [50, 95, 99])
+            stages[stage] = {
+                "count": len(values),
+                "total_s": round(float(millis.sum()) / 1000, 3),
+                "p50_ms": round(float(p50), 2),
+                "p95_ms": round(float(p95), 2),
+                "p99_ms": round(float(p99), 2),
+                "max_ms": round(float(millis.max()), 2),
+            }
+        summary = {
+            "run": run,
+            "started_at": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+            "elapsed_s": round(time.time() - self.started, 3),
+            "stages": stages,
+            "counters": snapshot["counters"],
+        }
+        summary.update(extra)
+        return summary
+
+    # Appends this run's summary as one JSON line and returns it
+    def write_summary(self, run, path=METRICS_PATH, **extra):
+        summary = self.summary(run, **extra)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(summary, default=str) + "\n")
+        return summary
+
+# Process-wide registry shared by the ETL, forecaster and dashboard
+metrics = Metrics()
+
+# Decorator form of metrics.timer
+def timed(stage):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with metrics.timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# One-line text form of a summary for the log file
+def format_summary(summary):
+    stages = ", ".join(
+        f"{stage} n={s['count']} p50={s['p50_ms']}ms p95={s['p95_ms']}ms p99={s['p99_ms']}ms"
+        for stage, s in summary["stages"].items()
+    )
+    counters = ", ".join(f"{name}={value}" for name, value in sorted(summary["counters"].items()))
+    return f"Metrics [{summary['run']}] {summary['elapsed_s']}s: {stages}; {counters}"
+
+
+# ---- Profiling ----
+# Each thread keeps its own profiler per hot path; dump_profiles() merges them into one .prof per path.
+
+profiling_enabled = PROFILE_ENABLED
+profiles_lock = threading.Lock()
+profiles = defaultdict(list)
+profile_local = threading.local()
+
+def set_profiling(enabled):
+    global profiling_enabled
+    profiling_enabled = enabled
+
+@contextmanager
+def profiled(name):
+    # Nested hot paths are already covered by the outer profiler
+    if not profiling_enabled or getattr(profile_local, "active", False):
+        yield
+        return
+    thread_profiles = getattr(profile_local, "profiles", None)
+    if thread_profiles is None:
+        thread_profiles = profile_local.profiles = {}
+    profiler = thread_profiles.get(name)
+    if profiler is None:
+        profiler = thread_profiles[name] = cProfile.Profile()
+        with profiles_lock:
+            profiles[name].append(profiler)
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is already active (Python 3.12+ allows only one at a time)
+        yield
+        return
+    profile_local.active = True
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profile_local.active = False
+
+# Writes <name><suffix>.prof for every profiled hot path; view with `python -m pstats` or snakeviz
+def dump_profiles(directory=PROFILE_DIR, suffix=""):
+    with profiles_lock:
+        collected = {name: list(profilers) for name, profilers in profiles.items()}
+    paths = []
+    for name, profilers in collected.items():
+        stats = None
+        for profiler in profilers:
+            try:
+                if stats is None:
+                    stats = pstats.Stats(profiler)
+                else:
+                    stats.add(profiler)
+            except TypeError:
+                continue  # profiler that never collected anything
+        if stats is None:
+            continue
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{name}{suffix}.prof")
+        stats.dump_stats(path)
+        paths.append(path)
+    return paths
@@ -0,0 +1,357 @@
+import os
+import argparse
+import psycopg2
+from datetime import date
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Partitions are created this many months past the current month
+PARTITION_MONTHS_AHEAD = int(os.getenv("DB_PARTITION_MONTHS_AHEAD", "3"))
+# Partitions older than this are detached by the retention routine
+RETENTION_MONTHS = int(os.getenv("DB_RETENTION_MONTHS", "24"))
+# (city_id, date) days recomputed per statement when backfilling the rollup tables
+ROLLUP_BACKFILL_BATCH_DAYS = int(os.getenv("DB_ROLLUP_BACKFILL_BATCH_DAYS", "1000"))
+
+
+# Connect to PostgreSQL
+def get_db_connection():
+    conn = psycopg2.connect(
+            dbname=os.getenv("DB_NAME"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            host=os.getenv("DB_HOST"),
+            port=os.getenv("DB_PORT")
+        )
+    return conn
+
+def add_months(month_start, months):
+    index = month_start.year * 12 + month_start.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month_start):
+    return f"weather_data_{month_start:%Y_%m}"
+
+def table_exists(cursor, name):
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (name,))
+    return cursor.fetchone()[0]
+
+def is_partitioned(cursor, name):
+    cursor.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table p
+            JOIN pg_class c ON c.oid = p.partrelid
+            WHERE c.oid = to_regclass(%s)
+        );
+    """, (name,))
+    return cursor.fetchone()[0]
+
+# True when some unique index covers exactly these columns (in any order), whatever its name,
+# so ON CONFLICT on them already works
+def has_unique_index(cursor, table, columns):
+    cursor.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_index i
+            WHERE i.indrelid = to_regclass(%s) AND i.indisunique
+              AND i.indpred IS NULL AND i.indexprs IS NULL
+              AND ARRAY(SELECT a.attname::text FROM pg_attribute a
+                        WHERE a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+                        ORDER BY a.attname) = %s::text[]
+        );
+    """, (table, sorted(columns)))
+    return cursor.fetchone()[0]
+
+
+# ---- Migrations ----
+# Each migration takes a cursor and runs inside the migrate() transaction.
+
+# Unique keys the ETL upserts rely on (ON CONFLICT needs a matching unique index)
+def migration_unique_keys(cursor):
+    if not has_unique_index(cursor, "weather_data", ["city_id", "date", "time"]):
+        # Keep the first copy of any observation that was inserted twice before the index existed
+        cursor.execute("""
+            DELETE FROM weather_data a
+            USING weather_data b
+            WHERE a.city_id = b.city_id AND a.date = b.date AND a.time = b.time
+              AND a.ctid > b.ctid;
+        """)
+        cursor.execute("""
+            CREATE UNIQUE INDEX weather_data_city_date_time_key
+            ON weather_data (city_id, date, time);
+        """)
+
+    if not has_unique_index(cursor, "weather_types", ["weather_name"]):
+        # Concurrent workers inserted some types twice: keep the lowest id per name,
+        # repoint observations at it and drop the other copies
+        cursor.execute("""
+            UPDATE weather_data w
+            SET weather_type_id = dup.keep_id
+            FROM (
+                SELECT weather_type_id, MIN(weather_type_id) OVER (PARTITION BY weather_name) AS keep_id
+                FROM weather_types
+                WHERE weather_name IS NOT NULL
+            ) dup
+            WHERE w.weather_type_id = dup.weather_type_id AND dup.weather_type_id <> dup.keep_id;
+        """)
+        cursor.execute("""
+            DELETE FROM weather_types a
+            USING weather_types b
+            WHERE a.weather_name = b.weather_name AND a.weather_type_id > b.weather_type_id;
+        """)
+        cursor.execute("""
+            CREATE UNIQUE INDEX weather_types_weather_name_key
+            ON weather_types (weather_name);
+        """)
+
+    # The forecaster has always upserted on this key, so most databases already have it
+    if not has_unique_index(cursor, "weather_forecast", ["city_id", "forecast_date", "forecast_time"]):
+        cursor.execute("""
+            CREATE UNIQUE INDEX weather_forecast_city_date_time_key
+            ON weather_forecast (city_id, forecast_date, forecast_time);
+        """)
+
+# Rebuild weather_data as a table range-partitioned by month on date
+def migration_partition_weather_data(cursor):
+    if is_partitioned(cursor, "weather_data"):
+        return
+
+    # LIKE never copies the primary key's index or any foreign keys, so note them to recreate below
+    cursor.execute("""
+        SELECT con.conname, con.contype, pg_get_constraintdef(con.oid),
+               ARRAY(SELECT att.attname FROM unnest(con.conkey) WITH ORDINALITY k(attnum, n)
+                     JOIN pg_attribute att ON att.attrelid = con.conrelid AND att.attnum = k.attnum
+                     ORDER BY k.n)
+        FROM pg_constraint con
+        WHERE con.conrelid = 'weather_data'::regclass AND con.contype IN ('p', 'f')
+        ORDER BY con.contype DESC, con.conname;
+    """)
+    constraints = cursor.fetchall()
+
+    cursor.execute("ALTER TABLE weather_data RENAME TO weather_data_legacy;")
+    cursor.execute("ALTER INDEX IF EXISTS weather_data_city_date_time_key RENAME TO weather_data_legacy_city_date_time_key;")
+    for name, contype, _, _ in constraints:
+        if contype == "p":
+            cursor.execute(f'ALTER TABLE weather_data_legacy RENAME CONSTRAINT "{name}" TO "{name}_legacy";')
+    cursor.execute("""
+        CREATE TABLE weather_data (LIKE weather_data_legacy INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+        PARTITION BY RANGE (date);
+    """)
+    # The unique key includes the partition column, so it can live on the parent
+    cursor.execute("""
+        CREATE UNIQUE INDEX weather_data_city_date_time_key ON weather_data (city_id, date, time);
+    """)
+
+    # Serial sequences belong to the old table; move them so dropping it keeps the sequences
+    cursor.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'weather_data_legacy'
+          AND column_default LIKE 'nextval(%';
+    """)
+    for (column,) in cursor.fetchall():
+        cursor.execute("SELECT pg_get_serial_sequence('weather_data_legacy', %s);", (column,))
+        sequence = cursor.fetchone()[0]
+        if sequence:
+            cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY weather_data."{column}";')
+
+    cursor.execute("SELECT MIN(date), MAX(date) FROM weather_data_legacy;")
+    first, last = cursor.fetchone()
+    today = date.today().replace(day=1)
+    first = (first or today).replace(day=1)
+    last = max((last or today).replace(day=1), today)
+    create_month_partitions(cursor, first, add_months(last, PARTITION_MONTHS_AHEAD))
+    cursor.execute("CREATE TABLE IF NOT EXISTS weather_data_default PARTITION OF weather_data DEFAULT;")
+
+    cursor.execute("INSERT INTO weather_data SELECT * FROM weather_data_legacy;")
+
+    # Added after the copy so each is built or validated once rather than per row.
+    # A primary key on a partitioned table has to include the partition column.
+    for name, contype, definition, columns in constraints:
+        if contype == "p":
+            key = ", ".join(f'"{column}"' for column in columns + (["date"] if "date" not in columns else []))
+            cursor.execute(f'ALTER TABLE weather_data ADD CONSTRAINT "{name}" PRIMARY KEY ({key});')
+        else:
+            cursor.execute(f'ALTER TABLE weather_data ADD CONSTRAINT "{name}" {definition};')
+    cursor.execute("DROP TABLE weather_data_legacy;")
+
+# Stable GeoNames ids (and population) so the city loader can merge on a key instead of float coordinates
+def migration_city_geonames_ids(cursor):
+    cursor.execute("ALTER TABLE cities ADD COLUMN IF NOT EXISTS geonames_id BIGINT;")
+    cursor.execute("ALTER TABLE cities ADD COLUMN IF NOT EXISTS population BIGINT;")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS cities_geonames_id_key ON cities (geonames_id);")
+# Hourly/daily rollup tables the dashboard's trend views read, backfilled from the existing
+# history a batch of (city_id, date) days at a time
+def migration_weather_rollups(cursor):
+    from Weather_ETL_DB import create_rollup_tables, refresh_rollup_days
+
+    create_rollup_tables(cursor)
+    cursor.execute("SELECT DISTINCT city_id, date FROM weather_data WHERE date IS NOT NULL ORDER BY city_id, date;")
+    days = cursor.fetchall()
+    for start in range(0, len(days), ROLLUP_BACKFILL_BATCH_DAYS):
+        refresh_rollup_days(cursor, days[start:start + ROLLUP_BACKFILL_BATCH_DAYS])
+    print(f"Backfilled rollups for {len(days)} city-days")
+
+
+MIGRATIONS = [
+    (1, "unique keys for upserts", migration_unique_keys),
+    (2, "partition weather_data by month", migration_partition_weather_data),
+    (3, "geonames ids on cities", migration_city_geonames_ids),
+    (4, "hourly and daily weather rollups", migration_weather_rollups),
+]
+
+
+def ensure_migrations_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """)
+
+def applied_versions(cursor):
+    ensure_migrations_table(cursor)
+    cursor.execute("SELECT version FROM schema_migrations;")
+    return {row[0] for row in cursor.fetchall()}
+
+# Apply every pending migration, each in its own transaction
+def migrate(conn, target=None):
+    applied = []
+    with conn.cursor() as cursor:
+        done = applied_versions(cursor)
+    conn.commit()
+
+    for version, name, apply in MIGRATIONS:
+        if version in done or (target is not None and version > target):
+            continue
+        try:
+            with conn.cursor() as cursor:
+                apply(cursor)
+                cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s);", (version, name))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Applied migration {version}: {name}")
+        applied.append(version)
+    return applied
+
+
+# ---- Partition maintenance ----
+
+# Create monthly partitions from first_month up to and including last_month.
+# Rows that already landed in the default partition for a month are moved into the new
+# partition, since Postgres refuses to create a partition whose range the default still holds.
+def create_month_partitions(cursor, first_month, last_month):
+    created = []
+    has_default = table_exists(cursor, "weather_data_default")
+    month = first_month
+    while month <= last_month:
+        name = partition_name(month)
+        if not table_exists(cursor, name):
+            bounds = (month, add_months(month, 1))
+            moved = False
+            if has_default:
+                cursor.execute("""
+                    SELECT EXISTS (SELECT 1 FROM weather_data_default WHERE date >= %s AND date < %s);
+                """, bounds)
+                moved = cursor.fetchone()[0]
+            if moved:
+                cursor.execute("CREATE TEMP TABLE weather_partition_move (LIKE weather_data) ON COMMIT DROP;")
+                cursor.execute("""
+                    WITH moved AS (
+                        DELETE FROM weather_data_default WHERE date >= %s AND date < %s RETURNING *
+                    )
+                    INSERT INTO weather_partition_move SELECT * FROM moved;
+                """, bounds)
+            cursor.execute(f"""
+                CREATE TABLE {name} PARTITION OF weather_data
+                FOR VALUES FROM (%s) TO (%s);
+            """, bounds)
+            if moved:
+                cursor.execute("INSERT INTO weather_data SELECT * FROM weather_partition_move;")
+                cursor.execute("DROP TABLE weather_partition_move;")
+            created.append(name)
+        month = add_months(month, 1)
+    return created
+
+# Keep partitions ready for the coming months so new rows never land in the default partition.
+# Called by every ETL run and daily by the scheduler; a no-op before weather_data is partitioned.
+def ensure_future_partitions(conn, months_ahead=PARTITION_MONTHS_AHEAD):
+    today = date.today().replace(day=1)
+    with conn.cursor() as cursor:
+        created = []
+        if is_partitioned(cursor, "weather_data"):
+            created = create_month_partitions(cursor, today, add_months(today, months_ahead))
+    conn.commit()
+    return created
+
+# Monthly partitions of weather_data as [(name, month_start), ...], oldest first
+def list_month_partitions(cursor):
+    cursor.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass('weather_data')
+        ORDER BY c.relname;
+    """)
+    partitions = []
+    for (name,) in cursor.fetchall():
+        suffix = name[len("weather_data_"):]
+        try:
+            year, month = suffix.split("_")
+            partitions.append((name, date(int(year), int(month), 1)))
+        except ValueError:
+            continue  # default partition
+    return partitions
+
+# Detach partitions older than keep_months. Detached tables are renamed to
+# weather_archive_YYYY_MM so they can be dumped or dropped separately (drop=True drops them now).
+def detach_old_partitions(conn, keep_months=RETENTION_MONTHS, drop=False):
+    cutoff = add_months(date.today().replace(day=1), -keep_months)
+    detached = []
+    with conn.cursor() as cursor:
+        for name, month in list_month_partitions(cursor):
+            if month >= cutoff:
+                continue
+            cursor.execute(f"ALTER TABLE weather_data DETACH PARTITION {name};")
+            if drop:
+                cursor.execute(f"DROP TABLE {name};")
+            else:
+                cursor.execute(f"ALTER TABLE {name} RENAME TO weather_archive_{month:%Y_%m};")
+            detached.append(name)
+    conn.commit()
+    return detached
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Schema migrations and partition maintenance for weather_data")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = subparsers.add_parser("migrate", help="Apply pending migrations")
+    migrate_parser.add_argument("--target", type=int, help="Stop after this migration version")
+    subparsers.add_parser("status", help="List applied and pending migrations")
+    subparsers.add_parser("maintain", help="Create partitions for the coming months")
+    retain_parser = subparsers.add_parser("retain", help="Detach partitions older than the retention window")
+    retain_parser.add_argument("--keep-months", type=int, default=RETENTION_MONTHS)
+    retain_parser.add_argument("--drop", action="store_true", help="Drop old partitions instead of keeping them as archive tables")
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    try:
+        if args.command == "migrate":
+            applied = migrate(conn, args.target)
+            print(f"{len(applied)} migrations applied")
+        elif args.command == "status":
+            with conn.cursor() as cursor:
+                done = applied_versions(cursor)
+            conn.commit()
+            for version, name, _ in MIGRATIONS:
+                print(f"{version:>4}  {'applied' if version in done else 'pending':<8} {name}")
+        elif args.command == "maintain":
+            created = ensure_future_partitions(conn)
+            print(f"Created partitions: {', '.join(created) or 'none'}")
+        elif args.command == "retain":
+            detached = detach_old_partitions(conn, args.keep_months, args.drop)
+            print(f"Detached partitions: {', '.join(detached) or 'none'}")
+    finally:
+        conn.close()
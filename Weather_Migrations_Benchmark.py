@@ -0,0 +1,158 @@
+import argparse
+import random
+import statistics
+import time
+from Weather_Migrations import get_db_connection, migrate
+
+# Runs in its own schema so the real tables are never touched
+BENCH_SCHEMA = "weather_bench"
+
+# The hot queries of the ETL, dashboard and forecaster
+QUERIES = {
+    "entry exists (ETL dedupe)": """
+        SELECT 1 FROM weather_data WHERE city_id = %(city_id)s AND date = %(date)s AND time = %(time)s;
+    """,
+    "dates for city (dashboard)": """
+        SELECT DISTINCT date FROM weather_data WHERE city_id = %(city_id)s ORDER BY date DESC;
+    """,
+    "one city-day (dashboard)": """
+        SELECT time, temperature_c FROM weather_data WHERE city_id = %(city_id)s AND date = %(date)s;
+    """,
+    "last 7 days 15:00-18:30 (forecast)": """
+        SELECT city_id, date, time, temperature_c FROM weather_data
+        WHERE date >= %(end)s - 7 AND time BETWEEN '15:00' AND '18:30'
+        ORDER BY city_id, date, time;
+    """,
+}
+
+
+# Pre-migration shape of the schema: serial keys only, no composite indexes
+def create_bench_schema(cursor, schema=BENCH_SCHEMA):
+    cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE;")
+    cursor.execute(f"CREATE SCHEMA {schema};")
+    cursor.execute(f"SET search_path TO {schema};")
+    cursor.execute("""
+        CREATE TABLE cities (
+            city_id SERIAL PRIMARY KEY,
+            city_name VARCHAR(100),
+            latitude DOUBLE PRECISION,
+            longitude DOUBLE PRECISION
+        );
+        CREATE TABLE weather_types (
+            weather_type_id SERIAL PRIMARY KEY,
+            weather_name VARCHAR(100)
+        );
+        CREATE TABLE weather_data (
+            weather_data_id SERIAL PRIMARY KEY,
+            city_id INTEGER REFERENCES cities(city_id),
+            temperature_c DOUBLE PRECISION,
+            humidity_percent INTEGER,
+            wind_speed_mps DOUBLE PRECISION,
+            wind_direction_deg INTEGER,
+            weather_type_id INTEGER REFERENCES weather_types(weather_type_id),
+            weather_description VARCHAR(255),
+            date DATE,
+            time TIME
+        );
+        CREATE TABLE weather_forecast (
+            city_id INTEGER,
+            forecast_date DATE,
+            forecast_time TIME,
+            predicted_temperature_c DOUBLE PRECISION
+        );
+    """)
+
+# Readings every step_hours for every city going back `years` and `months` from now
+def fill_synthetic_data(cursor, cities, years=0, months=0, step_hours=1):
+    cursor.execute("""
+        INSERT INTO cities (city_name, latitude, longitude)
+        SELECT 'City ' || g, 24 + random() * 12, 61 + random() * 15
+        FROM generate_series(1, %s) g;
+    """, (cities,))
+    cursor.execute("INSERT INTO weather_types (weather_name) VALUES ('Clear'), ('Clouds'), ('Rain'), ('Haze');")
+    cursor.execute("""
+        INSERT INTO weather_data (city_id, temperature_c, humidity_percent, wind_speed_mps, wind_direction_deg,
+                                  weather_type_id, weather_description, date, time)
+        SELECT c, t, 40, 3.5, 180, 1 + (c + h) %% 4, 'synthetic', ts::date, ts::time
+        FROM generate_series(1, %(cities)s) c
+        CROSS JOIN generate_series(
+            date_trunc('hour', now()) - make_interval(years => %(years)s, months => %(months)s),
+            date_trunc('hour', now()),
+            make_interval(hours => %(step_hours)s)
+        ) ts
+        CROSS JOIN LATERAL (SELECT extract(hour FROM ts)::int AS h) hh
+        CROSS JOIN LATERAL (SELECT 25 + 10 * sin(h / 24.0 * 2 * pi()) AS t) tt;
+    """, {"cities": cities, "years": years, "months": months, "step_hours": step_hours})
+    cursor.execute("SELECT COUNT(*), MIN(date), MAX(date) FROM weather_data;")
+    return cursor.fetchone()
+
+# Median and p95 latency in milliseconds for each query over random parameters
+def time_queries(cursor, cities, first, last, repeats):
+    span = (last - first).days
+    rng = random.Random(42)
+    results = {}
+    for label, sql in QUERIES.items():
+        timings = []
+        for _ in range(repeats):
+            day = first.fromordinal(first.toordinal() + rng.randint(0, span))
+            params = {
+                "city_id": rng.randint(1, cities),
+                "date": day,
+                "time": f"{rng.randint(0, 23):02d}:00:00",
+                "end": last,
+            }
+            start = time.perf_counter()
+            cursor.execute(sql, params)
+            cursor.fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        results[label] = (statistics.median(timings), timings[int(len(timings) * 0.95) - 1])
+    return results
+
+
+def run_benchmark(cities, years, repeats, keep):
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            create_bench_schema(cursor)
+            print(f"Generating {years} years of hourly data for {cities} cities...")
+            rows, first, last = fill_synthetic_data(cursor, cities, years=years)
+            cursor.execute("ANALYZE;")
+        conn.commit()
+        print(f"{rows} rows from {first} to {last}")
+
+        with conn.cursor() as cursor:
+            before = time_queries(cursor, cities, first, last, repeats)
+        conn.commit()
+
+        start = time.perf_counter()
+        migrate(conn)
+        print(f"Migrations took {time.perf_counter() - start:.1f}s")
+
+        with conn.cursor() as cursor:
+            cursor.execute("ANALYZE;")
+            after = time_queries(cursor, cities, first, last, repeats)
+        conn.commit()
+
+        print(f"\n{'query':<36} {'before p50':>11} {'p95':>9} {'after p50':>11} {'p95':>9} {'speedup':>8}")
+        for label in QUERIES:
+            b50, b95 = before[label]
+            a50, a95 = after[label]
+            print(f"{label:<36} {b50:>9.2f}ms {b95:>7.2f}ms {a50:>9.2f}ms {a95:>7.2f}ms {b50 / max(a50, 1e-6):>7.1f}x")
+    finally:
+        if not keep:
+            conn.rollback()
+            with conn.cursor() as cursor:
+                cursor.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE;")
+            conn.commit()
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query latency on weather_data before and after the migrations")
+    parser.add_argument("--cities", type=int, default=50)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--repeats", type=int, default=50, help="Runs per query")
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark schema afterwards")
+    args = parser.parse_args()
+    run_benchmark(args.cities, args.years, args.repeats, args.keep)
@@ -1,15 +1,43 @@
 import os
+import json
+import time
+import argparse
 import pandas as pd
-from prophet import Prophet
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, table, column
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 import urllib.parse
 import numpy as np
+from multiprocessing import util
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from Weather_Metrics import metrics, timed, profiled, set_profiling, dump_profiles, format_summary
 
 # Load environment variables
 load_dotenv()
 
+# Upper bound on forecast worker processes (defaults to one per core)
+FORECAST_MAX_WORKERS = int(os.getenv("FORECAST_MAX_WORKERS", str(os.cpu_count() or 1)))
+
+# History window the forecaster trains on
+HISTORY_DAYS = 7
+WINDOW_START = "15:00"
+WINDOW_END = "18:30"
+MIN_HISTORY_ROWS = 5
+
+# Ridge penalty for the NumPy harmonic engine's trend and harmonic terms
+HARMONIC_RIDGE = float(os.getenv("FORECAST_HARMONIC_RIDGE", "0.1"))
+
+# On-disk cache of fitted Prophet models, keyed by city_id and history watermark
+MODEL_CACHE_ENABLED = os.getenv("FORECAST_MODEL_CACHE", "1") == "1"
+MODEL_CACHE_DIR = os.getenv("FORECAST_MODEL_CACHE_DIR", "forecast_model_cache")
+MODEL_CACHE_MAX_BYTES = int(float(os.getenv("FORECAST_MODEL_CACHE_MAX_MB", "200")) * 1024 * 1024)
+
+# Forecast targets as days_ahead@HH:MM; the default is next-day 5 PM
+FORECAST_HORIZONS = os.getenv("FORECAST_HORIZONS", "1@17:00")
+# Rows per multi-row upsert statement (4 bind params each, well under Postgres' 65535 limit)
+FORECAST_UPSERT_CHUNK = 5000
+
 # Setup database engine
 def get_db_engine():
     user = os.getenv("DB_USER")
@@ -27,6 +55,7 @@ def fetch_cities(engine):
 
 
 # Fetch city temperature data at 3 PM for past 7 days
+@timed("history_query")
 def fetch_city_temperature_data(city_id, engine):
     query = text("""
         SELECT date, time, temperature_c
@@ -57,6 +86,31 @@ def fetch_city_temperature_data(city_id, engine):
     return df
 
 
+# Fetch the afternoon history for every city in one query, ready for groupby("city_id")
+@timed("history_query")
+def fetch_all_temperature_data(engine, days=HISTORY_DAYS, window_start=WINDOW_START, window_end=WINDOW_END):
+    # date + time gives a timestamp, so ds is built by Postgres instead of string parsing
+    query = text("""
+        SELECT city_id, (date + time) AS ds, temperature_c AS y
+        FROM weather_data
+        WHERE date >= CURRENT_DATE - make_interval(days => :days)
+          AND time BETWEEN CAST(:window_start AS time) AND CAST(:window_end AS time)
+        ORDER BY city_id, date, time;
+    """)
+
+    return pd.read_sql(query, engine, params={
+        "days": days,
+        "window_start": window_start,
+        "window_end": window_end
+    }, parse_dates=["ds"])
+
+# Split the bulk history into one Prophet-ready frame per city
+def split_history_by_city(history):
+    return {
+        city_id: group[["ds", "y"]].reset_index(drop=True)
+        for city_id, group in history.groupby("city_id", sort=False)
+    }
+
 def save_forecast_to_db(engine, city_id, forecast_date, forecast_time, forecast_temp):
     # Ensure forecast_temp is a native Python float (not np.float64)
     if isinstance(forecast_temp, (np.floating, np.float64)):
@@ -75,34 +129,483 @@ def save_forecast_to_db(engine, city_id, forecast_date, forecast_time, forecast_
             "predicted_temperature_c": forecast_temp
         })
 
+forecast_table = table(
+    "weather_forecast",
+    column("city_id"),
+    column("forecast_date"),
+    column("forecast_time"),
+    column("predicted_temperature_c")
+)
+
+# Batched upsert of (city_id, forecast_date, forecast_time, predicted_temp) tuples:
+# multi-row INSERT ... ON CONFLICT statements inside a single transaction
+@timed("forecast_save")
+def save_forecasts_to_db(engine, forecasts, chunk_size=FORECAST_UPSERT_CHUNK):
+    # A row can only be updated once per statement, so the last value per key wins
+    latest = {}
+    for city_id, forecast_date, forecast_time, forecast_temp in forecasts:
+        latest[(city_id, forecast_date, forecast_time)] = float(forecast_temp)
+    rows = [
+        {
+            "city_id": city_id,
+            "forecast_date": forecast_date,
+            "forecast_time": forecast_time,
+            "predicted_temperature_c": forecast_temp
+        }
+        for (city_id, forecast_date, forecast_time), forecast_temp in latest.items()
+    ]
+    if not rows:
+        return 0
+
+    with engine.begin() as conn:
+        for start in range(0, len(rows), chunk_size):
+            stmt = pg_insert(forecast_table).values(rows[start:start + chunk_size])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["city_id", "forecast_date", "forecast_time"],
+                set_={"predicted_temperature_c": stmt.excluded.predicted_temperature_c}
+            )
+            conn.execute(stmt)
+    return len(rows)
+
+# Parse "1@17:00,2@17:00" into [(days_ahead, time), ...]
+def parse_horizons(spec):
+    horizons = []
+    for item in spec.split(","):
+        days, _, at = item.strip().partition("@")
+        horizons.append((int(days), datetime.strptime(at or "17:00", "%H:%M").time()))
+    return horizons
+
+# Forecast datetimes for the run, computed once so every city gets the same targets
+def forecast_targets(horizons=None):
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return [
+        datetime.combine((today + timedelta(days=days)).date(), at)
+        for days, at in (horizons or parse_horizons(FORECAST_HORIZONS))
+    ]
+
+# Fit and predict every target in one predict call; returns [(city_id, date, time, temp), ...] or None
+# history is the city's frame from the bulk loader; without it the city is queried on its own
+def compute_forecast(city_id, city_name, engine, targets=None, history=None, model_cache=None):
+    with profiled("compute_forecast"):
+        df = history if history is not None else fetch_city_temperature_data(city_id, engine)
+
+        if len(df) < MIN_HISTORY_ROWS:
+            metrics.incr("forecasts_skipped")
+            print(f"Not enough data to forecast for {city_name}")
+            return None
+
+        targets = targets or forecast_targets()
+        fit_start = time.perf_counter()
+        yhat, fitted = prophet_predict(df, targets, model_cache, city_id)
+        fit_seconds = time.perf_counter() - fit_start
+        metrics.incr("forecasts_ok")
+        if fitted:
+            metrics.record("prophet_fit", fit_seconds)
+            print(f"Fitted {city_name} in {fit_seconds:.2f}s")
+        else:
+            metrics.record("prophet_cached", fit_seconds)
+            metrics.incr("model_cache_hits")
+            print(f"Reused cached model for {city_name} in {fit_seconds:.2f}s")
+
+    return [
+        (city_id, target.date(), target.time(), round(float(value), 2))
+        for target, value in zip(targets, yhat)
+    ]
+
 # Forecast function
-def forecast_temperature_at_3pm(city_id, city_name, engine):
-    df = fetch_city_temperature_data(city_id, engine)
+def forecast_temperature_at_3pm(city_id, city_name, engine, targets=None, history=None):
+    with profiled("forecast_temperature_at_3pm"):
+        results = compute_forecast(city_id, city_name, engine, targets, history)
+        if results is None:
+            return None
+
+        save_forecasts_to_db(engine, results)
+        return results
+
+# Each worker process builds its own engine (and model cache) once and reuses it for every city it gets
+worker_engine = None
+worker_model_cache = None
+
+def init_forecast_worker(use_model_cache=False, profile=False):
+    global worker_engine, worker_model_cache
+    worker_engine = get_db_engine()
+    worker_model_cache = ForecastModelCache() if use_model_cache else None
+    metrics.reset()
+    set_profiling(profile)
+    if profile:
+        # Each worker writes its compute_forecast_<pid>.prof once, when the pool shuts it down
+        util.Finalize(None, dump_profiles, kwargs={"suffix": f"_{os.getpid()}"}, exitpriority=10)
+
+# Returns (forecasts, error, this city's timings and counters) for the parent to merge.
+# Failures are returned rather than raised so their metrics still reach the parent
+# instead of leaking into the worker's next city.
+def forecast_city_in_worker(city_id, city_name, targets, history=None):
+    results, error = None, None
+    try:
+        results = compute_forecast(city_id, city_name, worker_engine, targets, history, worker_model_cache)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    finally:
+        worker_metrics = metrics.snapshot(reset=True)
+    return results, error, worker_metrics
+
+# histories maps city_id to its history frame; None means query each city separately
+def city_history(histories, city_id):
+    if histories is None:
+        return None
+    return histories.get(city_id, pd.DataFrame(columns=["ds", "y"]))
+
+# Fits cities one after another and commits all forecasts once at the end
+def run_forecasts_sequential(engine, cities, targets, histories=None, model_cache=None):
+    forecasts = []
+    for city_id, city_name in cities:
+        try:
+            results = compute_forecast(city_id, city_name, engine, targets, city_history(histories, city_id),
+                                       model_cache)
+        except Exception as e:
+            metrics.incr("forecasts_failed")
+            print(f"Failed forecasting {city_name}: {e}")
+            continue
+        if results is not None:
+            forecasts.extend(results)
+
+    saved = save_forecasts_to_db(engine, forecasts)
+    print(f"Saved {saved} forecasts")
+
+# Fits cities across a process pool and writes all results in one batch
+def run_forecasts_parallel(engine, cities, targets, max_workers=FORECAST_MAX_WORKERS, histories=None,
+                           use_model_cache=False, profile=False):
+    workers = max(1, min(max_workers, os.cpu_count() or 1, len(cities)))
+    forecasts = []
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_forecast_worker,
+                             initargs=(use_model_cache, profile)) as executor:
+        futures = {
+            executor.submit(forecast_city_in_worker, city_id, city_name, targets,
+                            city_history(histories, city_id)): city_name
+            for city_id, city_name in cities
+        }
+        for future in as_completed(futures):
+            try:
+                results, error, worker_metrics = future.result()
+            except Exception as e:
+                results, error, worker_metrics = None, e, None
+            if worker_metrics is not None:
+                metrics.merge(worker_metrics)
+            if error is not None:
+                metrics.incr("forecasts_failed")
+                print(f"Failed forecasting {futures[future]}: {error}")
+                continue
+            if results is not None:
+                forecasts.extend(results)
+
+    saved = save_forecasts_to_db(engine, forecasts)
+    print(f"Saved {saved} forecasts from {workers} worker processes")
+
+# ---- Fitted model cache ----
+# One JSON file per city holding the serialized Prophet model, its fitted params and
+# the watermark (row count + latest ds) of the history it was fitted on. Unchanged
+# history reuses the model without refitting; new rows warm-start from the old params.
+# The directory is capped at max_bytes, evicting the least recently used cities first.
+
+class ForecastModelCache:
+    def __init__(self, root=MODEL_CACHE_DIR, max_bytes=MODEL_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
 
-    if len(df) < 5:
-        print(f"Not enough data to forecast for {city_name}")
-        return
+    def path(self, city_id):
+        return os.path.join(self.root, f"city_{city_id}.json")
+
+    def get(self, city_id):
+        path = self.path(city_id)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)  # mark as recently used
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def put(self, city_id, watermark, model):
+        from prophet.serialize import model_to_json
+
+        entry = {
+            "city_id": city_id,
+            "watermark": watermark,
+            "params": warm_start_params(model),
+            "model": model_to_json(model),
+        }
+        path = self.path(city_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        files = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(".json"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+# Identifies the history a model was fitted on
+def history_watermark(df):
+    return {"rows": int(len(df)), "last_ds": pd.Timestamp(df['ds'].max()).isoformat()}
+
+# Fitted MAP params in the shape Prophet.fit(init=...) expects
+def warm_start_params(model):
+    params = {}
+    for name in ["k", "m", "sigma_obs"]:
+        params[name] = float(model.params[name][0][0])
+    for name in ["delta", "beta"]:
+        params[name] = [float(value) for value in model.params[name][0]]
+    return params
+
+# ---- Forecasting engines ----
+# Every engine implements forecast(histories, targets_by_city) -> {city_id: array of yhat},
+# where histories maps city_id to a ds/y frame and targets_by_city maps city_id to datetimes.
+
+# Prophet fit + predict for one city's history, returned as (yhat, fitted)
+# With model_cache, unchanged history skips the fit (fitted=False) and new rows warm-start from the cached params
+def prophet_predict(df, targets, model_cache=None, city_id=None):
+    from prophet import Prophet  # heavy import, only paid when Prophet is used
+
+    future = pd.DataFrame({"ds": targets})
+    if model_cache is None:
+        model = Prophet()
+        model.fit(df)
+        return model.predict(future)['yhat'].to_numpy(), True
+
+    from prophet.serialize import model_from_json
+
+    watermark = history_watermark(df)
+    entry = model_cache.get(city_id)
+    if entry is not None and entry["watermark"] == watermark:
+        return model_from_json(entry["model"]).predict(future)['yhat'].to_numpy(), False
 
     model = Prophet()
-    model.fit(df)
+    try:
+        if entry is None:
+            raise ValueError("no cached params")
+        model.fit(df, init={name: np.asarray(value) for name, value in entry["params"].items()})
+    except Exception:
+        # Cold fit when there's nothing to warm-start from or the cached params don't fit
+        # (e.g. the changepoint count changed with the history length)
+        model = Prophet()
+        model.fit(df)
+
+    model_cache.put(city_id, watermark, model)
+    return model.predict(future)['yhat'].to_numpy(), True
+
+class ProphetForecaster:
+    name = "prophet"
+
+    def __init__(self, model_cache=None):
+        self.model_cache = model_cache
+
+    def forecast(self, histories, targets_by_city):
+        predictions = {}
+        for city_id, targets in targets_by_city.items():
+            df = histories.get(city_id)
+            if df is None or len(df) < MIN_HISTORY_ROWS:
+                continue
+            predictions[city_id], _ = prophet_predict(df, targets, self.model_cache, city_id)
+        return predictions
+
+# Least-squares trend + daily harmonic, fitted for all cities at once:
+#   y = b0 + b1 * days + b2 * sin(2*pi*hour/24) + b3 * cos(2*pi*hour/24)
+# Cities are padded into (cities, samples) matrices and solved with one batched
+# np.linalg.solve. A small ridge penalty on the non-intercept terms keeps the fit
+# stable when a city only has afternoon samples.
+class HarmonicForecaster:
+    name = "harmonic"
+
+    def __init__(self, ridge=HARMONIC_RIDGE):
+        self.ridge = ridge
+
+    @staticmethod
+    def features(seconds, reference):
+        days = (seconds - reference[:, None]) / 86400.0
+        angle = 2 * np.pi * (seconds % 86400) / 86400.0
+        return np.stack([np.ones_like(days), days, np.sin(angle), np.cos(angle)], axis=-1)
+
+    @staticmethod
+    def pad(arrays, width):
+        padded = np.zeros((len(arrays), width))
+        mask = np.zeros((len(arrays), width), dtype=bool)
+        for i, values in enumerate(arrays):
+            padded[i, :len(values)] = values
+            mask[i, :len(values)] = True
+        return padded, mask
 
-    # Generate forecast for 3 PM tomorrow
-    next_day_5pm = datetime.now().replace(hour=17, minute=0, second=0, microsecond=0) + timedelta(days=1)
-    future = pd.DataFrame({"ds": [next_day_5pm]})
-    forecast = model.predict(future)
+    def forecast(self, histories, targets_by_city):
+        city_ids = [
+            city_id for city_id in targets_by_city
+            if city_id in histories and len(histories[city_id]) >= MIN_HISTORY_ROWS
+        ]
+        if not city_ids:
+            return {}
 
-    predicted_temp = round(forecast.iloc[0]['yhat'], 2)
+        def to_seconds(values):
+            return np.asarray(pd.to_datetime(pd.Series(values)).to_numpy(dtype="datetime64[s]").astype(np.int64), dtype=float)
 
-    save_forecast_to_db(engine, city_id, next_day_5pm.date(), next_day_5pm.time(), predicted_temp)
+        history_seconds = [to_seconds(histories[city_id]["ds"]) for city_id in city_ids]
+        history_y = [histories[city_id]["y"].to_numpy(dtype=float) for city_id in city_ids]
+        target_seconds = [to_seconds(targets_by_city[city_id]) for city_id in city_ids]
+
+        seconds, mask = self.pad(history_seconds, max(len(values) for values in history_seconds))
+        y, _ = self.pad(history_y, seconds.shape[1])
+        future, future_mask = self.pad(target_seconds, max(len(values) for values in target_seconds))
+
+        # Trend is measured from each city's latest observation
+        reference = np.array([values.max() for values in history_seconds])
+        X = self.features(seconds, reference) * mask[..., None]
+
+        penalty = self.ridge * np.diag([0.0, 1.0, 1.0, 1.0])
+        xtx = np.einsum("nmi,nmj->nij", X, X) + penalty
+        xty = np.einsum("nmi,nm->ni", X, y * mask)
+        beta = np.linalg.solve(xtx, xty[..., None])[..., 0]
+
+        yhat = np.einsum("nti,ni->nt", self.features(future, reference), beta)
+        return {
+            city_id: yhat[i, future_mask[i]]
+            for i, city_id in enumerate(city_ids)
+        }
+
+FORECASTERS = {
+    "prophet": ProphetForecaster,
+    "harmonic": HarmonicForecaster,
+}
+
+# Run any engine over every city and write the results in one batch
+def run_forecasts_batched(engine, cities, targets, histories, forecaster):
+    names = dict(cities)
+    if histories is None:
+        histories = {city_id: fetch_city_temperature_data(city_id, engine) for city_id in names}
+
+    fit_start = time.perf_counter()
+    predictions = forecaster.forecast(histories, {city_id: targets for city_id in names})
+    elapsed = time.perf_counter() - fit_start
+    metrics.record(f"{forecaster.name}_fit", elapsed)
+    metrics.incr("forecasts_ok", len(predictions))
+    metrics.incr("forecasts_skipped", len(names) - len(predictions))
+
+    forecasts = [
+        (city_id, target.date(), target.time(), round(float(yhat), 2))
+        for city_id, values in predictions.items()
+        for target, yhat in zip(targets, values)
+    ]
+    skipped = len(names) - len(predictions)
+    if skipped:
+        print(f"Not enough data to forecast for {skipped} cities")
+    print(f"{forecaster.name} forecast {len(predictions)} cities in {elapsed:.2f}s")
+
+    saved = save_forecasts_to_db(engine, forecasts)
+    print(f"Saved {saved} forecasts")
+
+# Hold out the last holdout_days of each city's history as the test set
+def split_holdout(histories, holdout_days=1):
+    train, test = {}, {}
+    for city_id, df in histories.items():
+        if df.empty:
+            continue
+        cutoff = df['ds'].max().normalize() - pd.Timedelta(days=holdout_days - 1)
+        train_df = df[df['ds'] < cutoff].reset_index(drop=True)
+        test_df = df[df['ds'] >= cutoff].reset_index(drop=True)
+        if len(train_df) >= MIN_HISTORY_ROWS and not test_df.empty:
+            train[city_id] = train_df
+            test[city_id] = test_df
+    return train, test
+
+# Compare engines' accuracy and runtime on stored history
+def run_backtest(histories, forecasters, holdout_days=1):
+    train, test = split_holdout(histories, holdout_days)
+    targets_by_city = {city_id: list(df['ds']) for city_id, df in test.items()}
+    print(f"Backtest on {len(test)} cities, holding out the last {holdout_days} day(s)")
+
+    results = []
+    for forecaster in forecasters:
+        fit_start = time.perf_counter()
+        predictions = forecaster.forecast(train, targets_by_city)
+        elapsed = time.perf_counter() - fit_start
+
+        errors = np.concatenate([
+            predictions[city_id] - test[city_id]['y'].to_numpy(dtype=float)
+            for city_id in predictions
+        ]) if predictions else np.array([])
+        result = {
+            "engine": forecaster.name,
+            "cities": len(predictions),
+            "seconds": round(elapsed, 3),
+            "mae": round(float(np.abs(errors).mean()), 3) if errors.size else None,
+            "rmse": round(float(np.sqrt((errors ** 2).mean())), 3) if errors.size else None,
+        }
+        print(f"{result['engine']:>10}: {result['cities']} cities, {result['seconds']}s, "
+              f"MAE {result['mae']}, RMSE {result['rmse']}")
+        results.append(result)
+    return results
 
 # Main execution
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Forecast next-day temperatures for all cities")
+    parser.add_argument("--parallel", action="store_true",
+                        help="Fit cities across a process pool instead of one after another")
+    parser.add_argument("--workers", type=int, default=FORECAST_MAX_WORKERS,
+                        help="Max worker processes for --parallel (default: %(default)s)")
+    parser.add_argument("--per-city-history", action="store_true",
+                        help="Query each city's history separately instead of one bulk query")
+    parser.add_argument("--horizons", default=FORECAST_HORIZONS,
+                        help="Comma-separated days_ahead@HH:MM targets (default: %(default)s)")
+    parser.add_argument("--engine", choices=sorted(FORECASTERS), default="prophet",
+                        help="Forecasting engine (default: %(default)s)")
+    parser.add_argument("--backtest", action="store_true",
+                        help="Compare every engine on stored history instead of writing forecasts")
+    parser.add_argument("--history-days", type=int, default=HISTORY_DAYS,
+                        help="Days of history to load (default: %(default)s)")
+    parser.add_argument("--no-model-cache", dest="model_cache", action="store_false", default=MODEL_CACHE_ENABLED,
+                        help="Refit every Prophet model from scratch instead of reusing cached fits")
+    parser.add_argument("--profile", action="store_true",
+                        help="Write cProfile dumps of the per-city forecast path to METRICS_PROFILE_DIR")
+    args = parser.parse_args()
+    set_profiling(args.profile)
+
     engine = get_db_engine()
 
+    if args.backtest:
+        histories = split_history_by_city(fetch_all_temperature_data(engine, days=args.history_days))
+        run_backtest(histories, [forecaster() for forecaster in FORECASTERS.values()])
+        raise SystemExit(0)
+
     cities = fetch_cities(engine)
+    targets = forecast_targets(parse_horizons(args.horizons))
 
-    for city_id, city_name in cities:
-        try:
-            forecast_temperature_at_3pm(city_id, city_name, engine)
-        except Exception as e:
-            print(f"Failed forecasting {city_name}: {e}")
+    histories = None
+    if not args.per_city_history:
+        histories = split_history_by_city(fetch_all_temperature_data(engine, days=args.history_days))
+
+    if args.engine != "prophet":
+        run_forecasts_batched(engine, cities, targets, histories, FORECASTERS[args.engine]())
+    elif args.parallel:
+        run_forecasts_parallel(engine, cities, targets, args.workers, histories, args.model_cache, args.profile)
+    else:
+        model_cache = ForecastModelCache() if args.model_cache else None
+        run_forecasts_sequential(engine, cities, targets, histories, model_cache)
+
+    summary = metrics.write_summary("forecast", engine=args.engine, parallel=args.parallel)
+    print(format_summary(summary))
+    dump_profiles()
@@ -0,0 +1,160 @@
+import hashlib
+import threading
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Bounding box used for the heat map grid: (min_lat, max_lat, min_lon, max_lon)
+PAKISTAN_BOUNDS = (23.5, 37.5, 60.5, 77.5)
+# Query points per distance matrix when scikit-learn is not installed
+BRUTE_FORCE_CHUNK = 512
+
+
+# Great-circle distances (radians) between every point in a and every point in b, both (lat, lon) radians
+def haversine_matrix(a, b):
+    dlat = b[None, :, 0] - a[:, None, 0]
+    dlon = b[None, :, 1] - a[:, None, 1]
+    h = np.sin(dlat / 2) ** 2 + np.cos(a[:, None, 0]) * np.cos(b[None, :, 0]) * np.sin(dlon / 2) ** 2
+    return 2 * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+# Haversine BallTree over city coordinates. Rows are (city_id, city_name, latitude, longitude, ...)
+# as returned by fetch_cities_from_db; queries take degrees and return kilometres.
+# scikit-learn is optional: without it the same queries run as chunked brute-force NumPy haversine.
+class CityIndex:
+    def __init__(self, rows):
+        self.city_ids = np.array([row[0] for row in rows])
+        self.city_names = [row[1] for row in rows]
+        self.coords = np.array([(float(row[2]), float(row[3])) for row in rows], dtype=float).reshape(-1, 2)
+        self.radians = np.radians(self.coords)
+        self.positions = {city_id: i for i, city_id in enumerate(self.city_ids.tolist())}
+        try:
+            from sklearn.neighbors import BallTree  # heavy import, only paid when the index is built
+            self.tree = BallTree(self.radians, metric="haversine")
+        except ImportError:
+            self.tree = None
+
+    def __len__(self):
+        return len(self.city_ids)
+
+    # (distances, indices) of the k nearest cities to each point, in radians, closest first
+    def _query(self, points, k):
+        if self.tree is not None:
+            return self.tree.query(points, k=k)
+        distances = np.empty((len(points), k))
+        indices = np.empty((len(points), k), dtype=int)
+        for start in range(0, len(points), BRUTE_FORCE_CHUNK):
+            chunk = haversine_matrix(points[start:start + BRUTE_FORCE_CHUNK], self.radians)
+            nearest = np.argpartition(chunk, k - 1, axis=1)[:, :k]
+            nearest_distances = np.take_along_axis(chunk, nearest, axis=1)
+            order = np.argsort(nearest_distances, axis=1, kind="stable")
+            indices[start:start + len(chunk)] = np.take_along_axis(nearest, order, axis=1)
+            distances[start:start + len(chunk)] = np.take_along_axis(nearest_distances, order, axis=1)
+        return distances, indices
+
+    # Per point, the indices of the cities within radius (radians); with return_distance,
+    # (indices, distances) sorted closest first
+    def _query_radius(self, points, radius, return_distance=False):
+        if self.tree is not None:
+            return self.tree.query_radius(points, r=radius, return_distance=return_distance,
+                                          sort_results=return_distance)
+        indices, distances = [], []
+        for start in range(0, len(points), BRUTE_FORCE_CHUNK):
+            for row in haversine_matrix(points[start:start + BRUTE_FORCE_CHUNK], self.radians):
+                within = np.flatnonzero(row <= radius)
+                if return_distance:
+                    within = within[np.argsort(row[within], kind="stable")]
+                    distances.append(row[within])
+                indices.append(within)
+        return (indices, distances) if return_distance else indices
+
+    # Nearest k cities to one point as [(city_id, city_name, distance_km), ...], closest first
+    def nearest(self, lat, lon, k=5):
+        k = min(k, len(self))
+        distances, indices = self._query(np.radians([[lat, lon]]), k)
+        return [
+            (self.city_ids[i].item(), self.city_names[i], float(d * EARTH_RADIUS_KM))
+            for d, i in zip(distances[0], indices[0])
+        ]
+
+    # All cities within radius_km of a point, closest first
+    def within_radius(self, lat, lon, radius_km):
+        indices, distances = self._query_radius(
+            np.radians([[lat, lon]]), radius_km / EARTH_RADIUS_KM, return_distance=True
+        )
+        return [
+            (self.city_ids[i].item(), self.city_names[i], float(d * EARTH_RADIUS_KM))
+            for d, i in zip(distances[0], indices[0])
+        ]
+
+    # Greedy thinning: walk cities in priority order (highest first, default: row order) and keep a
+    # city only if no kept city lies within radius_km. Returns (kept city_ids, {city_id: representative city_id}).
+    def representative_cities(self, radius_km, priority=None):
+        order = np.arange(len(self)) if priority is None else np.argsort(-np.asarray(priority, dtype=float), kind="stable")
+        neighbours = self._query_radius(self.radians, radius_km / EARTH_RADIUS_KM)
+        represented_by = np.full(len(self), -1)
+        kept = []
+        for i in order:
+            if represented_by[i] >= 0:
+                continue
+            kept.append(i)
+            covered = neighbours[i]
+            represented_by[covered[represented_by[covered] < 0]] = i
+        kept_ids = [self.city_ids[i].item() for i in kept]
+        mapping = {self.city_ids[i].item(): self.city_ids[r].item() for i, r in enumerate(represented_by)}
+        return kept_ids, mapping
+
+    # Inverse-distance-weighted grid from {city_id: value}, using the k nearest cities of each cell.
+    # Cells farther than max_distance_km from every city are NaN so the map does not extrapolate.
+    # Returns (grid_lats, grid_lons, values) with values shaped (len(grid_lats), len(grid_lons)).
+    def interpolate_grid(self, values, bounds=PAKISTAN_BOUNDS, step_deg=0.25, k=8, power=2,
+                         max_distance_km=150):
+        min_lat, max_lat, min_lon, max_lon = bounds
+        grid_lats = np.arange(min_lat, max_lat + step_deg / 2, step_deg)
+        grid_lons = np.arange(min_lon, max_lon + step_deg / 2, step_deg)
+        mesh_lat, mesh_lon = np.meshgrid(grid_lats, grid_lons, indexing="ij")
+        cells = np.radians(np.column_stack([mesh_lat.ravel(), mesh_lon.ravel()]))
+
+        city_values = np.full(len(self), np.nan)
+        for city_id, value in values.items():
+            position = self.positions.get(city_id)
+            if position is not None and value is not None:
+                city_values[position] = value
+
+        distances, indices = self._query(cells, min(k, len(self)))
+        distances_km = distances * EARTH_RADIUS_KM
+        neighbour_values = city_values[indices]
+        known = ~np.isnan(neighbour_values)
+
+        weights = np.where(known, 1.0 / np.maximum(distances_km, 1e-6) ** power, 0.0)
+        total = weights.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result = (weights * np.nan_to_num(neighbour_values)).sum(axis=1) / total
+        nearest_known = np.where(known, distances_km, np.inf).min(axis=1)
+        result[(total == 0) | (nearest_known > max_distance_km)] = np.nan
+        return grid_lats, grid_lons, result.reshape(mesh_lat.shape)
+
+
+# Identifies the set of cities and their coordinates; the index only has to be rebuilt when this changes
+def cities_fingerprint(rows):
+    digest = hashlib.sha1()
+    for row in sorted(rows, key=lambda row: row[0]):
+        digest.update(f"{row[0]}:{row[1]}:{float(row[2]):.5f}:{float(row[3]):.5f};".encode())
+    return digest.hexdigest()
+
+
+index_lock = threading.Lock()
+cached_index = None
+cached_fingerprint = None
+
+# Shared CityIndex for these rows, rebuilt only when the cities (ids or coordinates) change
+def get_city_index(rows):
+    global cached_index, cached_fingerprint
+    if not rows:
+        return None
+    fingerprint = cities_fingerprint(rows)
+    with index_lock:
+        if cached_index is None or fingerprint != cached_fingerprint:
+            cached_index = CityIndex(rows)
+            cached_fingerprint = fingerprint
+        return cached_index